@@ -34,6 +34,9 @@ setup(
         "opencv-python>=3",
         "matplotlib>=2",
     ],
+    extras_require={
+        "jit": ["numba"],
+    },
     entry_points={
         'console_scripts': [
             'sldtk=sldtk:cli',
@@ -1,29 +1,62 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+from . import kernels
+from .models.limb_model import DEFAULT_LUT_SIZE
+
 
-def correct_disk(img, disk_attr, bias, model):
+def correct_disk(img, disk_attr, bias, model, lut=None, threads=1, out=None,
+                 jit=None):
     """Perform a flat field correction on a solar disk.
 
     Parameters
     ----------
     img : numpy.ndarray
-        An image containing a solar disk.
-    disk_attr : tuple of 3 ints
-        The x, y and r properties of the solar disk present in the image.
+        An image containing a solar disk, which may be partially cut off by
+        the edges of the image.
+    disk_attr : tuple of 3 numbers
+        The x, y and r properties of the solar disk present in the image
+        (e.g. as fitted by `detection.fit_circle`).
     bias : int or float
         Brightness level of the disk's centre.
     model : limb_model.LimbModel
         Model used for radius-based flat field generation.
+    lut : int or numpy.ndarray, optional
+        Evaluate `model` through a lookup table of this size (or through a
+        table generated by `model.lut`) rather than at every pixel.
+    threads : int, optional
+        Number of worker threads to split the disk between (as bands of
+        rows), or of threads running the JIT compiled kernel. None uses one
+        thread per CPU.
+    out : numpy.ndarray, optional
+        Array of the same shape and dtype as `img` to write the corrected
+        image into. A new array is allocated if omitted, and `img` is
+        corrected in place if it is passed as `out`. A floating point `out`
+        receives the corrected values unclipped and unrounded (e.g. for
+        scientific use).
+    jit : bool, optional
+        Correct the disk with the JIT compiled kernel (see `kernels`), which
+        always evaluates `model` through a lookup table (of default size if
+        `lut` is omitted). By default the kernel is only used when `lut` is
+        given and Numba is available, so that installing Numba does not
+        change the results, and only on the main thread (see `kernels`).
 
     Returns
     -------
     numpy.ndarray
-        Flat field corrected version of the input image.
+        Flat field corrected version of the input image (`out`).
 
     Raises
     ------
     TypeError
         If the image is multichannel (i.e. color).
+    ValueError
+        If `out` does not match the shape of `img`, or is neither of its
+        dtype nor floating point.
 
     Notes
     -----
@@ -33,22 +66,222 @@ def correct_disk(img, disk_attr, bias, model):
     of contrast of and within faclula, and is primarily done to increase
     umbra/penumbra distinction.
 
+    As the flat field only depends on the distance from the disk center,
+    a lookup table of a few thousand samples is sufficient for any disk
+    size; its worst case error is given by `model.lut_error`.
+
+    The bands are corrected with NumPy ufuncs writing into preallocated
+    buffers, which release the GIL and therefore scale with `threads`.
+
     """
     if len(img.shape) > 2:
         raise TypeError("`img` appears to be a color image. Currently only "
                         "grayscale images can be flat-field corrected.")
 
+    if out is None:
+        out = img.copy()
+    elif out is not img:
+        if out.shape != img.shape or (out.dtype != img.dtype and not
+                                      np.issubdtype(out.dtype, np.floating)):
+            raise ValueError("`out` must match the shape of `img`, and "
+                             "either its dtype or be floating point.")
+        np.copyto(out, img)
+
     d_x, d_y, d_r = disk_attr
+    if jit is None and lut is None:
+        jit = False  # The kernel would change the results, see `jit`.
+    jit = kernels.use_jit(jit)
+    if jit and lut is None:
+        lut = DEFAULT_LUT_SIZE
+    if lut is not None and np.isscalar(lut):
+        lut = model.lut(lut)  # Sample once rather than once per band.
+    if threads is None:
+        threads = os.cpu_count() or 1
+
+    # Clip the disk's bounding box to the image for partially cut disks.
+    top = max(int(math.floor(d_y-d_r)), 0)
+    left = max(int(math.floor(d_x-d_r)), 0)
+    disk = out[top:max(int(math.ceil(d_y+d_r)), 0),
+               left:max(int(math.ceil(d_x+d_r)), 0)]
+    if jit:
+        if model.i_0 is None:
+            raise RuntimeError("Absolute intensity evaluation requested but "
+                               "no center intensity has been set.")
+        with kernels.num_threads(threads):
+            kernels.correct_region(disk, top, left, d_x, d_y, d_r, bias,
+                                   np.ascontiguousarray(lut, dtype=float),
+                                   model.i_0,
+                                   not np.issubdtype(out.dtype, np.floating))
+        return out
+    bands = _row_bands(disk.shape[0], threads)
+
+    def correct_band(band):
+        start, stop = band
+        _correct_region(disk[start:stop], top+start, left, disk_attr, bias,
+                        model, lut)
+
+    if len(bands) == 1:
+        correct_band(bands[0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(bands)) as pool:
+            list(pool.map(correct_band, bands))
+
+    return out
+
+
+def correct_stream(frames, bias, model, pool=None, **kwargs):
+    """Flat field correct a sequence of frames into recycled buffers.
+
+    Parameters
+    ----------
+    frames : iterable of (numpy.ndarray, tuple)
+        Images together with the disk attributes of their solar disk.
+    bias : int or float
+        Brightness level of the disk's centre.
+    model : limb_model.LimbModel
+        Model used for radius-based flat field generation.
+    pool : BufferPool, optional
+        Pool to take output buffers from; a private pool by default.
+    **kwargs
+        Forwarded to `correct_disk`.
+
+    Yields
+    ------
+    numpy.ndarray
+        The corrected frames. Each buffer is returned to the pool when the
+        next frame is requested, so it must be copied if it is to outlive
+        the iteration.
+
+    """
+    if pool is None:
+        pool = BufferPool()
+    for img, disk_attr in frames:
+        out = pool.get(img.shape, img.dtype)
+        try:
+            yield correct_disk(img, disk_attr, bias, model, out=out, **kwargs)
+        finally:
+            pool.release(out)
+
+
+class BufferPool(object):
+    """Recycle arrays between frames rather than allocating new ones.
 
-    xx, yy = np.ogrid[0:2*d_r, 0:2*d_r]
-    distances = np.sqrt(np.square(xx-d_r)+np.square(yy-d_r)) / d_r
-    distances = np.ma.masked_array(distances, mask=(distances >= 1))
+    Buffers are kept per shape and dtype, so frames of different sizes can
+    share a pool. The pool is thread safe.
 
-    flat = model.eval(distances, absolute=True)
+    """
+    def __init__(self):
+        self._free = dict()
+        self._lock = threading.Lock()
+
+    def get(self, shape, dtype):
+        """Take a buffer (with undefined contents) from the pool."""
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buf):
+        """Return a buffer to the pool for reuse."""
+        key = (buf.shape, buf.dtype)
+        with self._lock:
+            self._free.setdefault(key, list()).append(buf)
+
+
+def correct_region(img, window, disk_attr, bias, model, lut=None):
+    """Perform a flat field correction on a window of a solar image.
+
+    Only the pixels of the window are evaluated, which makes it possible to
+    correct small regions (e.g. tiles for display) of huge images from
+    previously determined disk attributes and model coefficients.
+
+    Parameters
+    ----------
+    img : numpy.ndarray
+        An image containing a solar disk. It is not modified.
+    window : tuple of 4 ints
+        The x, y (top left corner), width and height of the window.
+    disk_attr : tuple of 3 numbers
+        The x, y and r properties of the solar disk present in the image.
+    bias : int or float
+        Brightness level of the disk's centre.
+    model : limb_model.LimbModel
+        Model used for radius-based flat field generation.
+    lut : int or numpy.ndarray, optional
+        Lookup table size or table, see `correct_disk`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Flat field corrected copy of the window, clipped to the image.
+
+    Raises
+    ------
+    TypeError
+        If the image is multichannel (i.e. color).
+
+    """
+    if len(img.shape) > 2:
+        raise TypeError("`img` appears to be a color image. Currently only "
+                        "grayscale images can be flat-field corrected.")
+
+    x, y, width, height = window
+    top, left = max(y, 0), max(x, 0)
+    region = img[top:max(y+height, 0), left:max(x+width, 0)].copy()
+
+    d_x, d_y, d_r = disk_attr
+    if (top >= d_y+d_r or top+region.shape[0] <= d_y-d_r or
+            left >= d_x+d_r or left+region.shape[1] <= d_x-d_r):
+        return region  # Window does not overlap the disk.
+
+    if lut is not None and np.isscalar(lut):
+        lut = model.lut(lut)
+    _correct_region(region, top, left, disk_attr, bias, model, lut)
+    return region
+
+
+def _row_bands(num_rows, num_bands):
+    """Split `num_rows` rows into at most `num_bands` contiguous bands."""
+    edges = np.linspace(0, num_rows, num=max(1, num_bands)+1).astype(int)
+    return [(start, stop) for start, stop in zip(edges[:-1], edges[1:])
+            if stop > start] or [(0, num_rows)]
+
+
+def _correct_region(region, y_0, x_0, disk_attr, bias, model, lut=None):
+    """Flat field correct the on-disk pixels of `region` in place.
+
+    `y_0` and `x_0` are the image coordinates of the region's top left
+    pixel, making it possible to correct any window of the disk
+    independently. Off-disk pixels are left untouched, and on-disk pixels
+    are only clipped and rounded for integer regions.
+
+    """
+    d_x, d_y, d_r = disk_attr
+    rows = np.arange(y_0, y_0+region.shape[0], dtype=float) - d_y
+    cols = np.arange(x_0, x_0+region.shape[1], dtype=float) - d_x
 
-    disk = img[d_y-d_r:d_y+d_r, d_x-d_r:d_x+d_r].copy()
-    disk = (disk / flat) * bias
+    # Squared relative distances.
+    distances = np.square(rows)[:, np.newaxis] + np.square(cols)
+    np.divide(distances, d_r**2, out=distances)
+    on_disk = distances < 1
+    np.minimum(distances, 1., out=distances)
 
-    img[d_y-d_r:d_y+d_r, d_x-d_r:d_x+d_r] = np.clip(disk, 0, 255).round()
+    if lut is None:
+        np.sqrt(distances, out=distances)
+        flat = model.eval(distances, absolute=True)
+    else:
+        # The table is indexed by cos(psi) = sqrt(1 - distance**2).
+        np.subtract(1., distances, out=distances)
+        np.sqrt(distances, out=distances)
+        flat = model.eval_lut_cos_psi(distances, absolute=True, lut=lut)
 
-    return img
+    # Off-disk values may divide by zero, but are never written back.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(region, flat, out=flat)
+        np.multiply(flat, bias, out=flat)
+        if not np.issubdtype(region.dtype, np.floating):
+            np.clip(flat, 0, 255, out=flat)
+            np.rint(flat, out=flat)
+        np.copyto(region, flat, casting='unsafe', where=on_disk)
@@ -0,0 +1,388 @@
+import calendar
+import contextlib
+import json
+import os
+import re
+import struct
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows.
+    fcntl = None
+
+COLUMNS = ("timestamp", "disk", "coefs")
+
+_TIMESTAMP_PATTERN = re.compile(r"(\d{8})_(\d{6})")
+
+# Column files have fixed size headers, so they can be grown in place.
+_HEADER_SIZE = 256
+
+
+def timestamp_from_filename(path):
+    """Parse the observation time from an image name (e.g. SDO/HMI's
+    ``20140704_022325_4096_HMII.jpg``).
+
+    Returns
+    -------
+    float or None
+        POSIX timestamp (UTC) of the observation, or None if the name holds
+        no timestamp.
+
+    """
+    match = _TIMESTAMP_PATTERN.search(os.path.basename(path))
+    if match is None:
+        return None
+    try:
+        parsed = time.strptime("".join(match.groups()), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return float(calendar.timegm(parsed))
+
+
+class ProfileDatabase(object):
+    """Append-only, columnar store of per-frame profiles and coefficients.
+
+    Records are buffered in memory and appended to chunks of up to
+    `chunk_size` records, with one .npy file per column which is grown in
+    place and memory mapped when queried. Chunks entirely outside a queried
+    time window are never read.
+
+    Parameters
+    ----------
+    path : str
+        Directory holding the database (created if needed).
+    model : str, optional
+        Name of the model whose coefficients are stored. Required for new
+        databases, and checked against existing ones.
+    chunk_size : int, optional
+        Number of records buffered before they are written, and the number
+        of records per chunk of a new database.
+
+    Raises
+    ------
+    ValueError
+        If `model` does not match an existing database, or is missing for
+        a new one.
+
+    Notes
+    -----
+    Several processes may append to the same database, as writes are
+    serialized by a lock on the database (where `fcntl` is available).
+    Other processes' records become visible when the database is reopened.
+
+    """
+    def __init__(self, path, model=None, chunk_size=1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._meta_path = os.path.join(path, "metadata.json")
+        if os.path.isfile(self._meta_path):
+            self.meta = self._read_meta()
+            if model is not None and model != self.meta["model"]:
+                raise ValueError("Database holds {} coefficients, not {}."
+                                 .format(self.meta["model"], model))
+        elif model is None:
+            raise ValueError("A model must be given for a new database.")
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {"model": model, "num_coefs": None,
+                         "chunk_size": chunk_size, "chunks": list()}
+        self._buffer = list()
+
+    def __len__(self):
+        return (sum(chunk["count"] for chunk in self.meta["chunks"]) +
+                len(self._buffer))
+
+    def append(self, timestamp, disk_attr, profile, coefs, name=""):
+        """Add the results for a single frame.
+
+        Parameters
+        ----------
+        timestamp : float
+            POSIX timestamp of the frame.
+        disk_attr : tuple of 3 numbers
+            The x, y and r properties of the frame's solar disk.
+        profile : numpy.ndarray
+            Intensity profile of the frame.
+        coefs : sequence of numbers
+            Fitted model coefficients.
+        name : str, optional
+            Name of the frame (e.g. its file name).
+
+        Raises
+        ------
+        ValueError
+            If the number of coefficients differs from previous records.
+
+        """
+        coefs = np.asarray(coefs, dtype=float)
+        if self.meta["num_coefs"] is None:
+            self.meta["num_coefs"] = len(coefs)
+        elif len(coefs) != self.meta["num_coefs"]:
+            raise ValueError("Expected {} coefficients, got {}.".format(
+                self.meta["num_coefs"], len(coefs)))
+        self._buffer.append((float(timestamp), tuple(disk_attr),
+                             np.asarray(profile, dtype=float), coefs, name))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered records, filling up the last chunk first.
+
+        Raises
+        ------
+        ValueError
+            If another process has meanwhile stored records with a different
+            number of coefficients.
+
+        """
+        if not self._buffer:
+            return
+        with self._locked():
+            # Pick up the records other processes have appended meanwhile.
+            if os.path.isfile(self._meta_path):
+                meta = self._read_meta()
+                if meta["num_coefs"] is None:
+                    meta["num_coefs"] = self.meta["num_coefs"]
+                elif meta["num_coefs"] != self.meta["num_coefs"]:
+                    raise ValueError("Expected {} coefficients, got {}."
+                                     .format(meta["num_coefs"],
+                                             self.meta["num_coefs"]))
+                self.meta = meta
+
+            records = self._buffer
+            chunks = self.meta["chunks"]
+            while records:
+                if (not chunks or
+                        chunks[-1]["count"] >= self.meta["chunk_size"]):
+                    chunks.append({"name": "chunk_{:05d}".format(len(chunks)),
+                                   "count": 0, "start": None, "end": None})
+                space = self.meta["chunk_size"] - chunks[-1]["count"]
+                self._append_chunk(chunks[-1], records[:space])
+                records = records[space:]
+
+            tmp_path = self._meta_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.meta, f)
+            os.replace(tmp_path, self._meta_path)
+        self._buffer = list()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def column(self, column, start=None, end=None):
+        """Load a column for the records within a time window.
+
+        Parameters
+        ----------
+        column : {"timestamp", "disk", "coefs", "name"}
+            Column to load.
+        start, end : float, optional
+            Inclusive time window (POSIX timestamps); unbounded if omitted.
+
+        Returns
+        -------
+        numpy.ndarray
+            The column's values in the order they were appended. Buffered
+            (unflushed) records are not included.
+
+        """
+        if column == "name":
+            return np.array([bytes(name).decode("utf-8")
+                             for name in self._ragged("name", start, end)],
+                            dtype=str)
+        parts = [self._load(chunk, column)[mask]
+                 for chunk, mask in self._chunks(start, end)]
+        if not parts:
+            shape = {"disk": (0, 3),
+                     "coefs": (0, self.meta["num_coefs"] or 0)}
+            return np.empty(shape.get(column, (0,)))
+        return np.concatenate(parts)
+
+    def profiles(self, start=None, end=None):
+        """Load the profiles of the records within a time window.
+
+        Returns
+        -------
+        list of numpy.ndarray
+            Profiles (memory mapped) in the order they were appended.
+
+        """
+        return self._ragged("profile", start, end)
+
+    def summary(self, column="coefs", start=None, end=None, bin_width=None):
+        """Summary statistics of a numeric column over a time window.
+
+        Parameters
+        ----------
+        column : {"coefs", "disk", "timestamp"}, optional
+            Column to summarize (per coefficient/attribute).
+        start, end : float, optional
+            Inclusive time window (POSIX timestamps).
+        bin_width : float, optional
+            Split the window into bins of this many seconds (starting at
+            the first record) and summarize each bin.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            "count", "mean", "std", "min" and "max", plus "median" for the
+            whole window, or the "time" at which each bin starts. Binned
+            statistics have the bins along their first axis; empty bins are
+            left out.
+
+        """
+        values = self.column(column, start, end)
+        if bin_width is None:
+            if not len(values):
+                return {"count": np.array(0)}
+            return {"count": np.array(len(values)),
+                    "mean": values.mean(axis=0),
+                    "std": values.std(axis=0),
+                    "median": np.median(values, axis=0),
+                    "min": values.min(axis=0),
+                    "max": values.max(axis=0)}
+
+        timestamps = self.column("timestamp", start, end)
+        if not len(timestamps):
+            return {"count": np.zeros(0, dtype=int)}
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        values = values[order]
+        bins = np.floor((timestamps - timestamps[0]) / bin_width)
+        starts = np.flatnonzero(np.diff(bins, prepend=-1))
+        count = np.diff(np.append(starts, len(values)))
+        shape = (-1,) + (1,) * (values.ndim - 1)
+        mean = np.add.reduceat(values, starts, axis=0) / count.reshape(shape)
+        squares = np.add.reduceat(np.square(values), starts, axis=0)
+        var = np.maximum(squares / count.reshape(shape) - mean**2, 0.)
+        return {"time": timestamps[0] + bins[starts] * bin_width,
+                "count": count,
+                "mean": mean,
+                "std": np.sqrt(var),
+                "min": np.minimum.reduceat(values, starts, axis=0),
+                "max": np.maximum.reduceat(values, starts, axis=0)}
+
+    def _chunks(self, start, end):
+        """Yield (chunk, mask) for the chunks overlapping the time window."""
+        for chunk in self.meta["chunks"]:
+            if ((start is not None and chunk["end"] < start) or
+                    (end is not None and chunk["start"] > end)):
+                continue
+            timestamps = self._load(chunk, "timestamp")
+            mask = np.ones(len(timestamps), dtype=bool)
+            if start is not None:
+                mask &= timestamps >= start
+            if end is not None:
+                mask &= timestamps <= end
+            yield chunk, mask
+
+    def _ragged(self, column, start, end):
+        """Values of a column of variable length records, as views."""
+        values = list()
+        for chunk, mask in self._chunks(start, end):
+            data = self._load(chunk, column)
+            offsets = self._load(chunk, column + "_offsets")
+            values.extend(data[offsets[i]:offsets[i+1]]
+                          for i in np.flatnonzero(mask))
+        return values
+
+    def _load(self, chunk, column):
+        """Memory map the committed part of a column of `chunk`."""
+        path = os.path.join(self.path, chunk["name"], column + ".npy")
+        values = np.load(path, mmap_mode="r")
+        if column.endswith("_offsets"):
+            return values[:chunk["count"] + 1]
+        if column in COLUMNS:
+            return values[:chunk["count"]]
+        return values
+
+    def _append_chunk(self, chunk, records):
+        """Append records to the column files of `chunk` (in place)."""
+        chunk_dir = os.path.join(self.path, chunk["name"])
+        os.makedirs(chunk_dir, exist_ok=True)
+        timestamps, disks, profiles, coefs, names = zip(*records)
+        count = chunk["count"]
+
+        columns = {
+            "timestamp": np.array(timestamps),
+            "disk": np.array(disks, dtype=float),
+            "coefs": np.array(coefs),
+        }
+        for column, values in columns.items():
+            _write_rows(os.path.join(chunk_dir, column + ".npy"), values,
+                        count)
+
+        ragged = {
+            "profile": profiles,
+            "name": [np.frombuffer(name.encode("utf-8"), dtype=np.uint8)
+                     for name in names],
+        }
+        for column, values in ragged.items():
+            offsets_path = os.path.join(chunk_dir, column + "_offsets.npy")
+            end = 0
+            if count:
+                # Read (rather than map) the file that is about to grow.
+                end = int(np.load(offsets_path)[count])
+            lengths = np.cumsum([len(v) for v in values]) + end
+            _write_rows(os.path.join(chunk_dir, column + ".npy"),
+                        np.concatenate(values), end)
+            if count:
+                _write_rows(offsets_path, lengths, count + 1)
+            else:
+                _write_rows(offsets_path, np.concatenate(([0], lengths)), 0)
+
+        first, last = min(timestamps), max(timestamps)
+        if count:
+            first, last = min(first, chunk["start"]), max(last, chunk["end"])
+        chunk.update(count=count + len(records), start=first, end=last)
+
+    def _read_meta(self):
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        meta.setdefault("chunk_size", self.chunk_size)
+        return meta
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold an exclusive lock on the database (where supported)."""
+        with open(os.path.join(self.path, "lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # The lock is released when the file is closed.
+
+
+def _write_rows(path, values, start):
+    """Write `values` to a .npy file from row `start` on.
+
+    Rows beyond `start` (left by an interrupted write) are overwritten or
+    truncated, and the header is rewritten to the new length.
+
+    """
+    values = np.ascontiguousarray(values)
+    row_size = values.itemsize * int(np.prod(values.shape[1:]))
+    shape = (start + len(values),) + values.shape[1:]
+    with open(path, "r+b" if os.path.isfile(path) else "w+b") as f:
+        f.seek(_HEADER_SIZE + start * row_size)
+        f.write(values.tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(_npy_header(values.dtype, shape))
+
+
+def _npy_header(dtype, shape):
+    """A .npy (version 1.0) header padded to `_HEADER_SIZE` bytes."""
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype),
+                   "fortran_order": False, "shape": tuple(shape)})
+    magic = np.lib.format.magic(1, 0)
+    size = _HEADER_SIZE - len(magic) - 2
+    return magic + struct.pack("<H", size) + header.ljust(size - 1).encode(
+        "latin1") + b"\n"
@@ -7,56 +7,411 @@ The module should choose backend based on availability (see #22).
 import cv2
 import numpy as np
 
+DETECTION_METHODS = ("mec", "fit")
+THRESHOLD_METHODS = ("auto", "otsu", "triangle")
 
-def detect_disk(img, threshold):
+
+def detect_disk(img, threshold, method="mec", return_threshold=False):
     """Determine the center and radius of a solar disk in an image.
 
     Parameters
     ----------
     img : numpy.ndarray
-        Greyscale image containing a full, single solar disk against a
-        background that is below `threshold`.
-    threshold : int
-        Minimum brightness threshold to be considered part of the solar disk.
-    
+        Greyscale image containing a single solar disk against a background
+        that is below `threshold`.
+    threshold : int or {"otsu", "triangle", "auto"}
+        Minimum brightness threshold to be considered part of the solar
+        disk, or the method used to estimate it from the image's histogram
+        ("auto" tries "triangle" before "otsu", see notes below).
+    method : {"mec", "fit"}, optional
+        Use the minimum enclosing circle of the disk's contour ("mec"), or
+        a robust least squares circle fit to its limb points ("fit"). The
+        latter is not biased by features protruding from the limb, and
+        handles disks that are partially outside the image.
+    return_threshold : bool, optional
+        Also return the threshold used.
+
     Returns
     -------
     disk attributes tuple of ints
         Center coordinates and radius of the largest disk found in `img`.
+    threshold : int
+        The (estimated) threshold (only if `return_threshold`).
 
     Raises
     ------
     TypeError
         If `img` is not a single channel numpy.ndarray image.
     RuntimeError
-        If no disk is found in `img`.
+        If no disk is found in `img`, or no estimated threshold yields a
+        plausible disk.
+    ValueError
+        If `method` or the threshold method is unknown.
+
+    Notes
+    -----
+    The triangle method derives the threshold from the mode of the dark
+    background, just above which the disk's sharp limb begins. It fails
+    when the disk covers more of the image than the background does, as
+    the histogram's mode then lies on the disk. "otsu" therefore only
+    searches for the triangle threshold below Otsu's threshold, i.e. in
+    the background class. Otsu's threshold itself is not used, as it
+    tends to split the limb darkened annulus from the bright center and
+    thereby cuts into the disk.
+
+    Estimated thresholds are therefore sanity checked: the detected contour
+    must be reasonably large and fill most of its enclosing circle (see
+    `_plausible_disk`), and its radius must agree with the radius found at
+    twice the threshold (see `_consistent_radius`). The histogram and blur
+    are computed only once, however many thresholds are tried.
 
     TODO
     ----
     Should maybe return None instead of raising an exception.
 
     """
+    if method not in DETECTION_METHODS:
+        raise ValueError("Unknown detection method {}.".format(method))
+
+    if method == "mec":
+        threshold, contour = _find_disk(img, threshold,
+                                        cv2.CHAIN_APPROX_SIMPLE)
+        (x, y), r = cv2.minEnclosingCircle(contour)
+    else:
+        threshold, contour = _find_disk(img, threshold, cv2.CHAIN_APPROX_NONE)
+        x, y, r = fit_circle(_limb_points(contour, img.shape))
+    if return_threshold:
+        return (round(x), round(y), round(r)), threshold
+    return round(x), round(y), round(r)
+
+
+def detect_ellipse(img, threshold, **kwargs):
+    """Determine the center, semi-axes and orientation of a solar disk.
+
+    Parameters
+    ----------
+    img : numpy.ndarray
+        Greyscale image containing a single solar disk against a background
+        that is below `threshold`.
+    threshold : int or str
+        Minimum brightness threshold to be considered part of the solar
+        disk, or how to estimate it (see `detect_disk`).
+    **kwargs
+        Forwarded to `fit_ellipse`.
+
+    Returns
+    -------
+    tuple of 5 floats
+        See `fit_ellipse`.
+
+    Raises
+    ------
+    TypeError
+        If `img` is not a single channel numpy.ndarray image.
+    RuntimeError
+        If no disk is found in `img`.
+
+    Notes
+    -----
+    Ellipses are for detection only (e.g. to measure the disk's flattening
+    or the distortion of the optics): stack extraction and correction
+    assume a circular disk, as given by `detect_disk`.
+
+    """
+    _, contour = _find_disk(img, threshold, cv2.CHAIN_APPROX_NONE)
+    return fit_ellipse(_limb_points(contour, img.shape), **kwargs)
+
+
+def fit_circle(points, tolerance=2., iterations=200, max_points=1000,
+               seed=0):
+    """Robustly fit a circle to a set of points.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array of shape (n, 2) holding the x and y coordinates of the points.
+    tolerance : float, optional
+        Maximum distance (in pixels) from the circle for a point to be
+        considered an inlier.
+    iterations : int, optional
+        Number of RANSAC hypotheses to evaluate.
+    max_points : int, optional
+        Number of randomly subsampled points hypotheses are scored on.
+    seed : int, optional
+        Seed of the random sampling, for reproducible results.
+
+    Returns
+    -------
+    tuple of 3 floats
+        Center coordinates and radius of the circle (x, y, r).
+
+    Raises
+    ------
+    RuntimeError
+        If there are too few points to fit a circle.
+
+    Notes
+    -----
+    All hypotheses (circles through three random points) are generated and
+    scored at once, after which the circle is refined by an algebraic least
+    squares fit to all its inliers.
+
+    """
+    shift, scale, points = _normalize_points(points, 3)
+    circle = _ransac(points, 3, _fit_circles, _circle_residuals,
+                     tolerance / scale, iterations, max_points, seed)
+    x, y, r = circle
+    if not np.isfinite(circle).all():
+        raise RuntimeError("No circle could be fitted to the limb.")
+    return x*scale + shift[0], y*scale + shift[1], r*scale
+
+
+def fit_ellipse(points, tolerance=2., iterations=200, max_points=1000,
+                seed=0):
+    """Robustly fit an ellipse to a set of points.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array of shape (n, 2) holding the x and y coordinates of the points.
+    tolerance : float, optional
+        Maximum (approximate) distance in pixels from the ellipse for a
+        point to be considered an inlier.
+    iterations : int, optional
+        Number of RANSAC hypotheses to evaluate.
+    max_points : int, optional
+        Number of randomly subsampled points hypotheses are scored on.
+    seed : int, optional
+        Seed of the random sampling, for reproducible results.
+
+    Returns
+    -------
+    tuple of 5 floats
+        Center coordinates, semi-major and semi-minor axes, and the angle
+        (in degrees, from the positive x axis towards the positive y axis)
+        of the major axis.
+
+    Raises
+    ------
+    RuntimeError
+        If there are too few points to fit an ellipse, or no ellipse fits
+        them.
+
+    Notes
+    -----
+    Hypotheses are conics through five random points, scored by their
+    Sampson (first order geometric) distance to the points.
+
+    """
+    shift, scale, points = _normalize_points(points, 5)
+    conic = _ransac(points, 5, _fit_conics, _conic_residuals,
+                    tolerance / scale, iterations, max_points, seed)
+    x, y, a, b, angle = _conic_to_ellipse(conic)
+    if not np.isfinite((a, b)).all():
+        raise RuntimeError("No ellipse could be fitted to the limb.")
+    return x*scale + shift[0], y*scale + shift[1], a*scale, b*scale, angle
+
+
+def _find_disk(img, threshold, approximation):
+    """Threshold the image and return (threshold, largest contour)."""
     if not isinstance(img, np.ndarray) or img.ndim > 2:
         raise TypeError("Expected single channel (grayscale) image.")
 
     blur = cv2.GaussianBlur(img, (5, 5), 0)
+    if not isinstance(threshold, str):
+        return threshold, _largest_contour(blur, threshold, approximation)
+
+    if threshold not in THRESHOLD_METHODS:
+        raise ValueError("Unknown threshold method {}.".format(threshold))
+    hist = np.bincount(blur.ravel(), minlength=256)
+    candidates = list()
+    if threshold in ("auto", "triangle"):
+        candidates.append(_triangle(hist))
+    if threshold in ("auto", "otsu"):
+        # The background's edge, below the level splitting it from the disk.
+        candidates.append(_triangle(hist[:_otsu(hist)]))
+
+    for candidate in candidates:
+        try:
+            contour = _largest_contour(blur, candidate, approximation)
+            reference = _largest_contour(blur, min(2 * candidate, 255),
+                                         cv2.CHAIN_APPROX_SIMPLE)
+        except RuntimeError:
+            continue
+        if (_plausible_disk(contour, img.shape) and
+                _consistent_radius(cv2.minEnclosingCircle(contour)[1],
+                                   [cv2.minEnclosingCircle(reference)[1]])):
+            return candidate, contour
+    raise RuntimeError("No plausible disk detected with estimated "
+                       "thresholds {}.".format(candidates))
+
+
+def _largest_contour(blur, threshold, approximation):
     mask = cv2.inRange(blur, threshold, 255)
-    img_mod, contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL,
-                                                    cv2.CHAIN_APPROX_SIMPLE)
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, approximation)[-2]
     # Determine and use the biggest contour found.
-    x = None
-    y = None
+    largest = None
     r = 0
     for cnt in contours:
-        (c_x, c_y), c_r = cv2.minEnclosingCircle(cnt)
+        _, c_r = cv2.minEnclosingCircle(cnt)
         if c_r > r:
-            x = c_x
-            y = c_y
+            largest = cnt
             r = c_r
-    # print("Number of contours found: {}".format(len(contours)))
-    # cv2.imwrite("out/disk_analyzer/mask.png", mask)
-    # cv2.imwrite("out/disk_analyzer/circled_contours.png", img)
-    if x is None:
+    if largest is None:
         raise RuntimeError("No disk detected in the image.")
-    return round(x), round(y), round(r)
+    return largest
+
+
+def _plausible_disk(contour, shape, min_radius=0.05, min_fill=0.6):
+    """Whether a contour is large enough and round enough to be the disk.
+
+    The radius of its enclosing circle must be at least `min_radius` of the
+    image's smaller dimension, and the contour must cover at least
+    `min_fill` of the circle (which still admits disks partly cut off by
+    the edges of the image).
+
+    """
+    _, r = cv2.minEnclosingCircle(contour)
+    if r < min_radius * min(shape[:2]):
+        return False
+    return cv2.contourArea(contour) >= min_fill * np.pi * r**2
+
+
+def _consistent_radius(r, references, tolerance=0.02):
+    """Whether radius `r` is within `tolerance` (relative) of the radii
+    found at other thresholds.
+
+    The limb is sharp, so the radius barely changes with the threshold,
+    unless the threshold cuts into the limb darkening or joins background
+    noise to the disk.
+
+    """
+    return all(ref is not None and abs(r - ref) <= tolerance * ref
+               for ref in references)
+
+
+def _otsu(hist):
+    """Otsu's threshold: the one maximizing between-class variance."""
+    p = hist / hist.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(len(p)))
+    denominator = omega * (1 - omega)
+    defined = denominator > 0
+    sigma_b = np.where(defined, (mu[-1]*omega - mu)**2 /
+                       np.where(defined, denominator, 1.), 0.)
+    # Pixels above the level splitting the classes belong to the disk.
+    return min(int(np.argmax(sigma_b)) + 1, 255)
+
+
+def _triangle(hist):
+    """Triangle threshold: the level farthest from the line between the
+    histogram's peak and the end of its longest tail."""
+    if not hist.any():
+        return len(hist)
+    levels = np.flatnonzero(hist)
+    low, high = levels[0], levels[-1]
+    peak = int(np.argmax(hist))
+    end = high if high - peak >= peak - low else low
+    if end == peak:
+        return peak + 1
+    idx = np.arange(min(peak, end), max(peak, end) + 1)
+    # Distance (up to a constant factor) from the peak-to-end line.
+    distance = np.abs((hist[end] - hist[peak]) * (idx - peak) -
+                      (end - peak) * (hist[idx] - hist[peak]))
+    return min(int(idx[np.argmax(distance)]) + (1 if end > peak else 0), 255)
+
+
+def _limb_points(contour, shape, margin=1):
+    """Contour points, excluding those along the edges of the image."""
+    points = contour.reshape(-1, 2).astype(float)
+    height, width = shape[:2]
+    on_limb = ((points[:, 0] >= margin) & (points[:, 0] < width-margin) &
+               (points[:, 1] >= margin) & (points[:, 1] < height-margin))
+    return points[on_limb]
+
+
+def _normalize_points(points, minimum):
+    """Center and scale points for numerically stable fitting."""
+    points = np.asarray(points, dtype=float)
+    if len(points) < minimum:
+        raise RuntimeError("Too few limb points to fit the disk.")
+    shift = points.mean(axis=0)
+    scale = points.std() or 1.
+    return shift, scale, (points - shift) / scale
+
+
+def _ransac(points, sample_size, fit, residuals, tolerance, iterations,
+            max_points, seed):
+    rng = np.random.RandomState(seed)
+    subset = points
+    if len(points) > max_points:
+        subset = points[rng.choice(len(points), max_points, replace=False)]
+
+    samples = subset[rng.randint(0, len(subset),
+                                 size=(iterations, sample_size))]
+    hypotheses = fit(samples)
+    with np.errstate(invalid='ignore'):
+        scores = (np.abs(residuals(hypotheses, subset)) < tolerance).sum(1)
+    best = hypotheses[np.argmax(scores)]
+
+    # Refine twice on the inliers of all points.
+    for _ in range(2):
+        with np.errstate(invalid='ignore'):
+            distance = np.abs(residuals(best[np.newaxis], points)[0])
+        inliers = distance < tolerance
+        if inliers.sum() < sample_size:
+            break
+        best = fit(points[inliers][np.newaxis])[0]
+    return best
+
+
+def _solve_normal(A, b):
+    """Batched least squares through the (slightly regularized) normal
+    equations, so that degenerate samples do not abort the batch."""
+    AT = A.swapaxes(1, 2)
+    ATA = np.matmul(AT, A) + 1e-12 * np.eye(A.shape[2])
+    return np.linalg.solve(ATA, np.matmul(AT, b[..., np.newaxis]))[..., 0]
+
+
+def _fit_circles(samples):
+    x, y = samples[..., 0], samples[..., 1]
+    A = np.stack((x, y, np.ones_like(x)), axis=-1)
+    D, E, F = _solve_normal(A, x**2 + y**2).T
+    c_x, c_y = D / 2, E / 2
+    with np.errstate(invalid='ignore'):
+        r = np.sqrt(F + c_x**2 + c_y**2)
+    return np.stack((c_x, c_y, r), axis=-1)
+
+
+def _circle_residuals(circles, points):
+    c_x, c_y, r = (p[:, np.newaxis] for p in circles.T)
+    return np.hypot(points[:, 0] - c_x, points[:, 1] - c_y) - r
+
+
+def _fit_conics(samples):
+    x, y = samples[..., 0], samples[..., 1]
+    A = np.stack((x**2, x*y, y**2, x, y), axis=-1)
+    return _solve_normal(A, np.ones_like(x))
+
+
+def _conic_residuals(conics, points):
+    """Sampson distance of the points to the conics (nan for conics that
+    are not ellipses)."""
+    A, B, C, D, E = (p[:, np.newaxis] for p in conics.T)
+    x, y = points[:, 0], points[:, 1]
+    value = A*x**2 + B*x*y + C*y**2 + D*x + E*y - 1
+    gradient = np.hypot(2*A*x + B*y + D, B*x + 2*C*y + E)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = value / gradient
+    return np.where(4*A*C - B**2 > 0, distance, np.nan)
+
 
+def _conic_to_ellipse(conic):
+    A, B, C, D, E = conic
+    x, y = np.linalg.solve([[2*A, B], [B, 2*C]], [-D, -E])
+    value = (D*x + E*y) / 2 - 1  # Conic evaluated at its center.
+    eigvals, eigvecs = np.linalg.eigh([[A, B/2], [B/2, C]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a, b = np.sqrt(-value / eigvals)
+    angle = np.degrees(np.arctan2(eigvecs[1, 0], eigvecs[0, 0])) % 180
+    return x, y, a, b, angle
@@ -3,14 +3,19 @@ import os
 
 import cv2
 
+from . import detection
 from . import models
 from . import profile
 
 
 def plot_correction(img, disk_attr, args, plotter):
-    stack = profile.extract_stack(img, disk_attr, args['slices'])
-    stack_clean = profile.clean_stack(stack)
-    intensity_profile = profile.compress_stack(stack_clean)
+    stack, valid = profile.extract_stack(img, disk_attr, args['slices'],
+                                         return_mask=True)
+    mask = profile.reject_outliers(stack, method=args['rejection'],
+                                   per_pixel=args['per_pixel'], valid=valid)
+    intensity_profile = profile.compress_stack(stack, mask=mask,
+                                               estimator=args['estimator'],
+                                               valid=valid)
     model = models.Linear()
     model.fit(intensity_profile)
     print("Linearity of correction: {}".format(model.coefs_str()))
@@ -50,6 +55,19 @@ def _pos_int(arg):
     return val
 
 
+def _pos_float(arg):
+    try:
+        val = float(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} could not be interpreted as a "
+                                         "number.".format(arg))
+    else:
+        if val <= 0:
+            raise argparse.ArgumentTypeError("{} is not a positive "
+                                             "number.".format(arg))
+    return val
+
+
 def _uint8(arg):
     try:
         val = int(arg)
@@ -63,6 +81,12 @@ def _uint8(arg):
     return val
 
 
+def _threshold(arg):
+    if arg.lower() in detection.THRESHOLD_METHODS:
+        return arg.lower()
+    return _uint8(arg)
+
+
 def _str2bool(arg):
     if arg.lower() in ('yes', 'true', 't', 'y', '1'):
         return True
@@ -88,14 +112,51 @@ def parse_input(config):
                     default=config["slices"],
                     help="Number of slices to average to create the intensity "
                          "profile.")
+    ap.add_argument("-a", "--adaptive",
+                    type=_pos_float,
+                    default=config["adaptive"],
+                    help="Extract slices (up to --slices) until no model "
+                         "coefficient changes by more than this.")
     ap.add_argument("-t", "--threshold",
-                    type=_uint8,
+                    type=_threshold,
                     default=config["threshold"],
-                    help="Brightness threshold for the solar disk (uint8).")
+                    help="Brightness threshold for the solar disk (uint8), "
+                         "or how to estimate it ({}).".format(
+                             ", ".join(detection.THRESHOLD_METHODS)))
+    ap.add_argument("-D", "--detection",
+                    choices=config["detection"],
+                    default=config["detection"][0],
+                    help="How to determine the disk's center and radius.")
     ap.add_argument("-b", "--bias",
                     type=_uint8,
                     default=config["bias"],
                     help="Brightness bias for the correction (uint8).")
+    ap.add_argument("-R", "--rejection",
+                    choices=config["rejection"],
+                    default=config["rejection"][0],
+                    help="Outlier rejection method for the slice stack.")
+    ap.add_argument("--per_pixel",
+                    type=_str2bool,
+                    nargs="?",
+                    const=True,
+                    default=config["per_pixel"],
+                    help="Reject individual pixels (e.g. sunspots) rather "
+                         "than whole slices.")
+    ap.add_argument("-E", "--estimator",
+                    choices=config["estimator"],
+                    default=config["estimator"][0],
+                    help="How to average the stack into a profile. "
+                         "weighted_mean also weights the model fit by the "
+                         "profile's inverse variance.")
+    ap.add_argument("-L", "--lut",
+                    type=_pos_int,
+                    default=config["lut"],
+                    help="Evaluate the model through a lookup table of this "
+                         "size during correction.")
+    ap.add_argument("--threads",
+                    type=_pos_int,
+                    default=config["threads"],
+                    help="Number of threads used for the correction.")
     ap.add_argument("-d", "--debug",
                     type=_str2bool,
                     nargs="?",
@@ -130,12 +191,38 @@ def parse_input(config):
                     const=True,
                     default=config["separate_dir"],
                     help="Generate separate output directories per image.")
+    ap.add_argument("-f", "--format",
+                    choices=config["format"],
+                    default=config["format"][0],
+                    help="Format of the corrected image (input uses the "
+                         "input image's format). npy and raw store unclipped "
+                         "float32 values.")
+    ap.add_argument("--png_compression",
+                    type=int,
+                    choices=range(10),
+                    default=config["png_compression"],
+                    help="PNG compression level (OpenCV's faster default "
+                         "strategy if omitted).")
+    ap.add_argument("--jpeg_quality",
+                    type=int,
+                    choices=range(101),
+                    metavar="{0..100}",
+                    default=config["jpeg_quality"],
+                    help="JPEG quality (OpenCV's default if omitted).")
+    ap.add_argument("--writer_threads",
+                    type=_pos_int,
+                    default=config["writer_threads"],
+                    help="Number of threads encoding output images.")
     ap.add_argument("--out_dir",
                     default=config["out_dir"],
                     help="Path to a custom output directory.")
     ap.add_argument("--debug_dir",
                     default=config["debug_dir"],
                     help="Path to a custom debug directory.")
+    ap.add_argument("--database",
+                    default=config["database"],
+                    help="Path to a profile database to append the "
+                         "profile and model coefficients to.")
     args = vars(ap.parse_args())
 
     if not os.path.isfile(args['image']):
@@ -153,10 +240,11 @@ def generate_output_paths(args):
         out_dir = os.path.join(out_dir, root)
     os.makedirs(out_dir, exist_ok=True)
 
+    out_ext = ext if args["format"] == "input" else "." + args["format"]
     paths = {
         'intensity': "{}/{}_intensity{}".format(out_dir, root, ext),
         'corrected': "{}/{}_corrected_{}{}".format(out_dir, root, args['bias'],
-                                                   ext),
+                                                   out_ext),
         'plot': "{}/{}_plot.png".format(out_dir, root)
     }
 
@@ -0,0 +1,110 @@
+"""
+Optional JIT compiled kernels fusing the per-pixel work of stack extraction
+and disk correction into single parallel passes without temporary arrays.
+
+Stack extraction uses its kernel automatically when Numba is installed
+(``pip install sldtk[jit]``), as the results are identical. The correction
+kernel always evaluates the model through a lookup table, and is therefore
+only used when one is requested (or when explicitly enabled). The NumPy
+implementations in `profile` and `correction` serve as fallback.
+
+The kernels are parallel themselves, and launching them from other threads
+than the main thread (e.g. from a thread pool) can abort the process or
+hang it at exit, depending on Numba's threading layer. They are therefore
+only used by default on the main thread.
+
+"""
+import contextlib
+import math
+import threading
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+
+def use_jit(jit):
+    """Resolve a `jit` argument (None meaning "if available and called from
+    the main thread").
+
+    Raises
+    ------
+    RuntimeError
+        If JIT compilation is explicitly requested but Numba is missing, or
+        the calling thread is not the main thread.
+
+    """
+    main = threading.current_thread() is threading.main_thread()
+    if jit is None:
+        return HAVE_NUMBA and main
+    if jit and not HAVE_NUMBA:
+        raise RuntimeError("JIT compiled kernels requested, but Numba is not "
+                           "installed.")
+    if jit and not main:
+        raise RuntimeError("JIT compiled kernels requested, but they can "
+                           "only be launched from the main thread.")
+    return bool(jit)
+
+
+@contextlib.contextmanager
+def num_threads(threads):
+    """Run the kernels called within on (at most) `threads` threads."""
+    if threads is None:
+        yield
+        return
+    previous = numba.get_num_threads()
+    numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+    try:
+        yield
+    finally:
+        numba.set_num_threads(previous)
+
+
+def _extract_stack(img, x, y, r, cos_theta, sin_theta, stack, valid):
+    """Gather `r` pixels along each ray into `stack` (in place)."""
+    height, width = img.shape
+    for s in numba.prange(cos_theta.shape[0]):
+        for k in range(r):
+            x_cart = int(math.floor(k * cos_theta[s] + x))
+            y_cart = int(math.floor(k * sin_theta[s] + y))
+            valid[s, k] = (0 <= x_cart < width) and (0 <= y_cart < height)
+            x_cart = min(max(x_cart, 0), width - 1)
+            y_cart = min(max(y_cart, 0), height - 1)
+            stack[s, k] = img[y_cart, x_cart]
+
+
+def _correct_region(region, y_0, x_0, d_x, d_y, d_r, bias, table, i_0,
+                    quantize):
+    """Flat field correct the on-disk pixels of `region` in place, looking
+    the flat field up in `table` (see `LimbModel.lut`). Values are clipped
+    and rounded to 8 bits if `quantize`."""
+    rows, cols = region.shape
+    last = table.shape[0] - 1
+    for i in numba.prange(rows):
+        dy = (y_0 + i) - d_y
+        for j in range(cols):
+            dx = (x_0 + j) - d_x
+            dist_sq = (dy*dy + dx*dx) / (d_r*d_r)
+            if dist_sq >= 1.:
+                continue
+            # The table is uniform in sqrt(cos(psi)).
+            pos = math.sqrt(math.sqrt(1. - dist_sq)) * last
+            k = min(int(pos), last - 1)
+            flat = (table[k] + (table[k+1] - table[k]) * (pos - k)) * i_0
+            value = region[i, j] / flat * bias
+            if quantize:
+                value = np.rint(min(max(value, 0.), 255.))
+            region[i, j] = value
+
+
+if HAVE_NUMBA:
+    extract_stack = numba.njit(parallel=True, cache=True)(_extract_stack)
+    correct_region = numba.njit(parallel=True, cache=True)(_correct_region)
+else:
+    extract_stack = None
+    correct_region = None
@@ -1,12 +1,23 @@
 from .limb_model import LimbModel
 from .polynomial import Polynomial
 from .linear import Linear
+from .quadratic import Quadratic
+from .square_root import SquareRoot
+from .logarithmic import Logarithmic
+from .power2 import Power2
+from .claret import Claret
 
 models = {
     "polynomial": Polynomial,
     "linear": Linear,
+    "quadratic": Quadratic,
+    "square-root": SquareRoot,
+    "logarithmic": Logarithmic,
+    "power-2": Power2,
+    "claret": Claret,
 }
 
 reference_models = {
     "poly-550": [Polynomial, "550nm", (0.3, 0.93, -0.23)],
-}
\ No newline at end of file
+    "eddington": [Quadratic, "Eddington", (0.6, 0.)],
+}
@@ -0,0 +1,20 @@
+import numpy as np
+
+from .law import Law
+
+
+class Claret(Law):
+    r"""Claret's four parameter non-linear limb darkening law.
+
+    :math:`I(\mu)/I(1) = 1 - \sum_{k=1}^{4} a_k (1 - \mu^{k/2})`
+
+    Although non-linear in :math:`\mu`, the law is linear in its
+    coefficients and is fitted in closed form.
+
+    """
+    names = ("a_1", "a_2", "a_3", "a_4")
+
+    @staticmethod
+    def _basis(mu):
+        sqrt_mu = np.sqrt(mu)
+        return 1 - sqrt_mu, 1 - mu, 1 - mu*sqrt_mu, 1 - mu**2
@@ -0,0 +1,136 @@
+r"""
+Limb darkening laws from stellar atmosphere modelling, expressed in terms of
+:math:`\mu = \cos{\psi}` and normalized to the center intensity.
+
+"""
+import abc
+import functools
+
+import numpy as np
+
+from .limb_model import LimbModel
+
+
+class Law(LimbModel):
+    r"""Base for limb darkening laws that are linear in their coefficients.
+
+    The relative intensity is modelled as
+    :math:`I(\mu)/I(1) = 1 - \sum_k c_k g_k(\mu)`, where the basis functions
+    :math:`g_k` vanish at the disk center. Such laws are fitted in closed
+    form by linear least squares.
+
+    Attributes
+    ----------
+    coefs : tuple of numbers
+        Coefficients :math:`c_k` of the law, either explicitly set or derived
+        by `fit`.
+
+    """
+    names = ()
+
+    def __init__(self):
+        self._coefs = None
+        self._i_0 = None
+
+    @staticmethod
+    @abc.abstractmethod
+    def _basis(mu):
+        """Return the basis functions :math:`g_k` evaluated at `mu`."""
+        pass
+
+    def fit(self, intensity_profile, params=None, variance=None):
+        """Fit the law to an intensity profile by linear least squares.
+
+        Parameters
+        ----------
+        intensity_profile : numpy.ndarray
+            Single dimension intensity profile to fit the law to.
+        params : optional
+            Limb darkening laws take no parameters.
+        variance : numpy.ndarray, optional
+            Variance of each element of `intensity_profile`, used to weight
+            the fit by inverse variance.
+
+        Notes
+        -----
+        The law is normalized by the first element of `intensity_profile`,
+        and it is therefore recommended to ensure that its value is
+        representative of the center intensity.
+
+        """
+        self._i_0 = intensity_profile[0]
+        A = self._design(len(intensity_profile))
+        b = 1 - intensity_profile / self._i_0
+        if variance is not None:
+            weights = self._fit_weights(intensity_profile, variance)
+            A = A * weights[:, np.newaxis]
+            b = b * weights
+
+        self._coefs = np.linalg.lstsq(A, b, rcond=None)[0]
+
+    def eval(self, x, absolute=False):
+        """Evaluate the law at a relative distance from center.
+
+        Parameters
+        ----------
+        x : float
+            Relative radial distance from center of the disk at which to
+            evaluate the law.
+        absolute : bool, optional
+            Whether to return a relative (False) or absolute (True)
+            brightness value for distance `x`.
+
+        Returns
+        -------
+        float
+            Intensity (relative or absolute depending on `absolute`) at `x`.
+
+        Raises
+        ------
+        RuntimeError
+            If absolute intensity is requested but a center intensity has
+            not been set.
+        """
+        if absolute and self._i_0 is None:
+            raise RuntimeError("Absolute intensity evaluation requested but "
+                               "no center intensity has been set.")
+
+        mu = self._dist_to_cos_psi(x)
+        i = 1.
+        for c, g in zip(self._coefs, self._basis(mu)):
+            i = i - c*g
+        if absolute:
+            i = i * self._i_0
+        return i
+
+    @property
+    def coefs(self):
+        return self._coefs
+
+    @coefs.setter
+    def coefs(self, coefs):
+        self._coefs = coefs
+
+    def coefs_str(self):
+        """Generate the string representation of the model's coefficients."""
+        if self._coefs is not None:
+            coefs = ["{}={:.2f}".format(n, c)
+                     for n, c in zip(self.names, self._coefs)]
+            return ', '.join(coefs)
+        else:
+            return None
+
+    @classmethod
+    @functools.lru_cache(maxsize=32)
+    def _design(cls, num):
+        """Design matrix for a profile of `num` elements (cached, as it only
+        depends on the profile length)."""
+        mu = cls._dist_to_cos_psi(np.linspace(0., 1., num=num))
+        A = np.column_stack(cls._basis(mu))
+        A.flags.writeable = False
+        return A
+
+
+def _mu_log_mu(mu):
+    r""":math:`\mu \ln{\mu}`, continuously extended to 0 at the limb."""
+    return mu * np.log(np.where(mu > 0, mu, 1.))
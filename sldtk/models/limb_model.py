@@ -1,11 +1,16 @@
 import abc
+import math
+
+import numpy as np
+
+DEFAULT_LUT_SIZE = 4096
 
 
 class LimbModel(metaclass=abc.ABCMeta):
     """Baseclass serving as poor man's interface for all limb models."""
 
     @abc.abstractmethod
-    def fit(self, intensity_profile, params=None):
+    def fit(self, intensity_profile, params=None, variance=None):
         pass
 
     @abc.abstractmethod
@@ -24,4 +29,205 @@ class LimbModel(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
     def coefs_str(self):
-        pass
\ No newline at end of file
+        pass
+
+    @property
+    def i_0(self):
+        """Center intensity used for absolute evaluation."""
+        return self._i_0
+
+    @i_0.setter
+    def i_0(self, i_0):
+        self._i_0 = i_0
+
+    def lut(self, size=DEFAULT_LUT_SIZE):
+        r"""Sample the (relative) model at equally spaced values of
+        :math:`\sqrt{\cos{\psi}}`.
+
+        Parameters
+        ----------
+        size : int, optional
+            Number of samples taken from the disk's limb
+            (:math:`\cos{\psi} = 0`) to its center (:math:`\cos{\psi} = 1`).
+
+        Returns
+        -------
+        numpy.ndarray
+            Relative intensities at ``numpy.linspace(0, 1, size)`` in
+            :math:`\sqrt{\cos{\psi}}`.
+
+        Raises
+        ------
+        ValueError
+            If fewer than two samples are requested.
+
+        Notes
+        -----
+        Intensity falls off with infinite slope in the radial distance at
+        the limb, whereas all models are smooth in
+        :math:`\sqrt{\cos{\psi}}` (which also covers the square root terms
+        of e.g. the square-root and Claret laws). A table which is uniform
+        in it is therefore accurate to better than 1e-5 with a thousand
+        samples, where a table uniform in distance needs millions.
+
+        """
+        if size < 2:
+            raise ValueError("A lookup table needs at least two samples.")
+        cos_psi = np.square(np.linspace(0., 1., num=size))
+        return self.eval(np.sqrt(np.maximum(1. - cos_psi**2, 0.)))
+
+    def eval_lut(self, x, absolute=False, lut=DEFAULT_LUT_SIZE,
+                 interpolate=True):
+        """Evaluate the model at relative distances through a lookup table.
+
+        Parameters
+        ----------
+        x : float or numpy.ndarray
+            Relative radial distance(s) from center of the disk. Masked
+            arrays keep their mask.
+        absolute : bool, optional
+            Whether to return a relative (False) or absolute (True)
+            brightness value for distance `x`.
+        lut : int or numpy.ndarray, optional
+            Size of the table to sample the model at, or a table previously
+            generated by `lut` (which can then be shared between calls).
+        interpolate : bool, optional
+            Linearly interpolate between table entries (True) or use the
+            nearest entry (False).
+
+        Returns
+        -------
+        float or numpy.ndarray
+            Intensity (relative or absolute depending on `absolute`) at `x`.
+
+        Raises
+        ------
+        RuntimeError
+            If absolute intensity is requested but a center intensity has
+            not been set.
+
+        Notes
+        -----
+        Distances outside [0, 1] are clamped to the ends of the table. The
+        deviation from `eval` is bounded by `lut_error`.
+
+        """
+        data = np.ma.getdata(x)
+        cos_psi = np.sqrt(np.maximum(1. - np.square(data), 0.))
+        i = self.eval_lut_cos_psi(cos_psi, absolute, lut, interpolate)
+        if isinstance(x, np.ma.MaskedArray):
+            i = np.ma.masked_array(i, mask=np.ma.getmask(x))
+        return i
+
+    def eval_lut_cos_psi(self, cos_psi, absolute=False, lut=DEFAULT_LUT_SIZE,
+                         interpolate=True):
+        r"""Evaluate the model at :math:`\cos{\psi}` through a lookup table.
+
+        Saves converting back and forth when the caller already has
+        :math:`\cos{\psi}` (e.g. from squared distances), see `eval_lut`
+        for the parameters.
+
+        """
+        if absolute and self._i_0 is None:
+            raise RuntimeError("Absolute intensity evaluation requested but "
+                               "no center intensity has been set.")
+
+        table = self.lut(lut) if np.isscalar(lut) else np.asarray(lut)
+        size = len(table)
+        pos = np.sqrt(cos_psi)  # The table is uniform in sqrt(cos(psi)).
+        if interpolate:
+            i = np.interp(pos, np.linspace(0., 1., num=size), table)
+        else:
+            idx = np.rint(np.multiply(pos, size - 1)).astype(np.intp)
+            i = table.take(idx, mode='clip')
+        if absolute:
+            i = i * self._i_0
+        return i
+
+    def lut_error(self, lut=DEFAULT_LUT_SIZE, interpolate=True, oversample=4):
+        """Measure the worst case deviation of `eval_lut` from `eval`.
+
+        Parameters
+        ----------
+        lut : int or numpy.ndarray, optional
+            Table size or table, see `eval_lut`.
+        interpolate : bool, optional
+            Lookup mode, see `eval_lut`.
+        oversample : int, optional
+            Number of test points per table interval.
+
+        Returns
+        -------
+        float
+            Maximum absolute error of the relative intensity.
+
+        """
+        table = self.lut(lut) if np.isscalar(lut) else np.asarray(lut)
+        # Test points spread evenly in both distance and cos(psi).
+        t = np.linspace(0., 1., num=(len(table) - 1) * oversample + 1)
+        x = np.concatenate((t, np.sqrt(1. - t**2)))
+        approx = self.eval_lut(x, lut=table, interpolate=interpolate)
+        return float(np.abs(approx - self.eval(x)).max())
+
+    def lut_size_for(self, tolerance, max_size=2**20, interpolate=True):
+        """Find the smallest power of two table size meeting a tolerance.
+
+        Parameters
+        ----------
+        tolerance : float
+            Largest acceptable absolute error of the relative intensity.
+        max_size : int, optional
+            Upper limit on the table size.
+        interpolate : bool, optional
+            Lookup mode, see `eval_lut`.
+
+        Returns
+        -------
+        int
+            Table size for which `lut_error` does not exceed `tolerance`.
+
+        Raises
+        ------
+        ValueError
+            If `tolerance` cannot be met within `max_size` samples.
+
+        """
+        size = 256
+        while size <= max_size:
+            if self.lut_error(size + 1, interpolate) <= tolerance:
+                return size + 1
+            size *= 2
+        raise ValueError("A tolerance of {} can not be met with a lookup "
+                         "table of at most {} samples.".format(tolerance,
+                                                               max_size))
+
+    @staticmethod
+    def _fit_weights(intensity_profile, variance):
+        """Least squares weights (inverse standard deviations) of the
+        normalized profile.
+
+        Unknown variances get the smallest weight of the profile, and zero
+        variances the largest.
+
+        """
+        variance = np.asarray(variance, dtype=float) / intensity_profile[0]**2
+        known = np.isfinite(variance)
+        positive = known & (variance > 0)
+        if not positive.any():
+            return np.ones(len(variance))
+        variance = np.where(known, variance, variance[positive].max())
+        variance = np.maximum(variance, variance[positive].min())
+        return 1. / np.sqrt(variance)
+
+    @staticmethod
+    def _dist_to_cos_psi(x):
+        if isinstance(x, np.ndarray):
+            if (x > 1).any() or (x < 0).any():
+                raise ValueError("relative distance is out of bounds.")
+            return np.sqrt(1 - x**2)
+        elif isinstance(x, float):
+            if x > 1 or x < 0:
+                raise ValueError("{} is out of bounds.".format(x))
+            return math.sqrt(1 - x**2)
+        else:
+            raise TypeError("Unable to evaluate {}.".format(type(x)))
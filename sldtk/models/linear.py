@@ -15,7 +15,7 @@ class Linear(LimbModel):
         self._coefs = None
         self._i_0 = None
 
-    def fit(self, intensity_profile, params=None):
+    def fit(self, intensity_profile, params=None, variance=None):
         """Fit a line to an intensity profile by linear regression.
 
         Parameters
@@ -24,6 +24,9 @@ class Linear(LimbModel):
             Single dimension intensity profile to fit the polynomial to.
         params : dict, optional
             The linear model takes no parameters.
+        variance : numpy.ndarray, optional
+            Variance of each element of `intensity_profile`, used to weight
+            the regression by inverse variance.
 
         Notes
         -----
@@ -38,6 +41,10 @@ class Linear(LimbModel):
         y_norm = intensity_profile / self._i_0
         x_norm = np.linspace(0., 1., num=r)
         A = np.vstack((x_norm, np.ones(len(x_norm)))).T
+        if variance is not None:
+            weights = self._fit_weights(intensity_profile, variance)
+            A = A * weights[:, np.newaxis]
+            y_norm = y_norm * weights
 
         self._coefs = np.linalg.lstsq(A, y_norm)[0]
 
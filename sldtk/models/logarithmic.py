@@ -0,0 +1,14 @@
+from .law import Law, _mu_log_mu
+
+
+class Logarithmic(Law):
+    r"""Logarithmic limb darkening law.
+
+    :math:`I(\mu)/I(1) = 1 - e (1 - \mu) - f \mu \ln{\mu}`
+
+    """
+    names = ("e", "f")
+
+    @staticmethod
+    def _basis(mu):
+        return 1 - mu, _mu_log_mu(mu)
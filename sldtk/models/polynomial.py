@@ -1,4 +1,3 @@
-import math
 import numpy as np
 import numpy.polynomial.polynomial as poly
 
@@ -21,7 +20,7 @@ class Polynomial(LimbModel):
         self._coefs = None
         self._i_0 = None
 
-    def fit(self, intensity_profile, params=None):
+    def fit(self, intensity_profile, params=None, variance=None):
         """Fit the polynomial to an intensity profile.
 
         If "degree" is not specified in `params`, the order of the
@@ -33,12 +32,16 @@ class Polynomial(LimbModel):
             Single dimension intensity profile to fit the polynomial to.
         params : int, optional
             Degree of the fitted polynomial.
+        variance : numpy.ndarray, optional
+            Variance of each element of `intensity_profile`, used to weight
+            the fit by inverse variance.
 
         Notes
         -----
         The polynomial is anchored to the first element of `intensity_profile`,
         and it is therefore recommended to ensure that its value is
-        representative of the center intensity.
+        representative of the center intensity. Without `variance` this is
+        done by heavily weighting the first element.
 
         TODO
         ----
@@ -57,8 +60,11 @@ class Polynomial(LimbModel):
         x_normalized = np.linspace(0., 1., num=r)
         x_cos_psi = np.sqrt(1 - x_normalized**2)
 
-        weights = np.ones(len(intensity_profile))
-        weights[0] = 1e5
+        if variance is None:
+            weights = np.ones(len(intensity_profile))
+            weights[0] = 1e5
+        else:
+            weights = self._fit_weights(intensity_profile, variance)
 
         self._coefs = poly.polyfit(x_cos_psi, y_normalized,
                                    w=weights, deg=degree)
@@ -111,16 +117,3 @@ class Polynomial(LimbModel):
             return ', '.join(coefs)
         else:
             return None
-
-    @staticmethod
-    def _dist_to_cos_psi(x):
-        if isinstance(x, np.ndarray):
-            if (x > 1).any() or (x < 0).any():
-                raise ValueError("relative distance is out of bounds.")
-            return np.sqrt(1 - x**2)
-        elif isinstance(x, float):
-            if x > 1 or x < 0:
-                raise ValueError("{} is out of bounds.".format(x))
-            return math.sqrt(1 - x**2)
-        else:
-            raise TypeError("Unable to evaluate {}.".format(type(x)))
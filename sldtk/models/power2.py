@@ -0,0 +1,138 @@
+import numpy as np
+
+from .limb_model import LimbModel
+
+MAX_ITERATIONS = 100
+
+
+class Power2(LimbModel):
+    r"""Power-2 limb darkening law.
+
+    :math:`I(\mu)/I(1) = 1 - c (1 - \mu^{\alpha})`
+
+    Attributes
+    ----------
+    coefs : tuple of numbers
+        The coefficients :math:`c` and :math:`\alpha`, either explicitly set
+        or derived by `fit`.
+
+    """
+    def __init__(self):
+        self._coefs = None
+        self._i_0 = None
+
+    def fit(self, intensity_profile, params=None, variance=None):
+        """Fit the law to an intensity profile by non-linear least squares.
+
+        Parameters
+        ----------
+        intensity_profile : numpy.ndarray
+            Single dimension intensity profile to fit the law to.
+        params : optional
+            The power-2 law takes no parameters.
+        variance : numpy.ndarray, optional
+            Variance of each element of `intensity_profile`, used to weight
+            the fit by inverse variance.
+
+        Notes
+        -----
+        The fit is a Levenberg-Marquardt iteration using the analytic
+        Jacobian of the law, starting from the closed form solution of
+        the linear law (:math:`\\alpha = 1`).
+
+        """
+        self._i_0 = intensity_profile[0]
+        r = len(intensity_profile)
+        y = 1 - intensity_profile / self._i_0
+        mu = self._dist_to_cos_psi(np.linspace(0., 1., num=r))
+        log_mu = np.log(np.where(mu > 0, mu, 1.))
+        if variance is None:
+            weights = np.ones(r)
+        else:
+            weights = self._fit_weights(intensity_profile, variance)
+
+        g = weights * (1 - mu)
+        params = np.array([np.dot(g, weights * y) / np.dot(g, g), 1.])
+        residuals = self._residuals(params, mu, y, weights)
+        cost = np.dot(residuals, residuals)
+        damping = 1e-3
+        for _ in range(MAX_ITERATIONS):
+            jac = self._jacobian(params, mu, log_mu, weights)
+            jtj = jac.T.dot(jac)
+            step = np.linalg.solve(jtj + damping*np.diag(np.diag(jtj)),
+                                   -jac.T.dot(residuals))
+            candidate = params + step
+            candidate[1] = max(candidate[1], 1e-6)  # Keep mu**alpha finite.
+            new_residuals = self._residuals(candidate, mu, y, weights)
+            new_cost = np.dot(new_residuals, new_residuals)
+            if new_cost < cost:
+                params, residuals, cost = candidate, new_residuals, new_cost
+                damping /= 10
+                if np.abs(step).max() < 1e-10:
+                    break
+            else:
+                damping *= 10
+                if damping > 1e10:
+                    break
+
+        self._coefs = params
+
+    def eval(self, x, absolute=False):
+        """Evaluate the law at a relative distance from center.
+
+        Parameters
+        ----------
+        x : float
+            Relative radial distance from center of the disk at which to
+            evaluate the law.
+        absolute : bool, optional
+            Whether to return a relative (False) or absolute (True)
+            brightness value for distance `x`.
+
+        Returns
+        -------
+        float
+            Intensity (relative or absolute depending on `absolute`) at `x`.
+
+        Raises
+        ------
+        RuntimeError
+            If absolute intensity is requested but a center intensity has
+            not been set.
+        """
+        if absolute and self._i_0 is None:
+            raise RuntimeError("Absolute intensity evaluation requested but "
+                               "no center intensity has been set.")
+
+        c, alpha = self._coefs
+        i = 1 - c*(1 - self._dist_to_cos_psi(x)**alpha)
+        if absolute:
+            i = i * self._i_0
+        return i
+
+    @property
+    def coefs(self):
+        return self._coefs
+
+    @coefs.setter
+    def coefs(self, coefs):
+        self._coefs = coefs
+
+    def coefs_str(self):
+        """Generate the string representation of the model's coefficients."""
+        if self._coefs is not None:
+            return "c={:.2f}, \\alpha={:.2f}".format(*self._coefs)
+        else:
+            return None
+
+    @staticmethod
+    def _residuals(params, mu, y, weights):
+        c, alpha = params
+        return weights * (c*(1 - mu**alpha) - y)
+
+    @staticmethod
+    def _jacobian(params, mu, log_mu, weights):
+        c, alpha = params
+        mu_alpha = mu**alpha
+        return np.column_stack((weights * (1 - mu_alpha),
+                                weights * (-c * mu_alpha * log_mu)))
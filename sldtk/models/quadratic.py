@@ -0,0 +1,17 @@
+from .law import Law
+
+
+class Quadratic(Law):
+    r"""Quadratic limb darkening law.
+
+    :math:`I(\mu)/I(1) = 1 - u_1 (1 - \mu) - u_2 (1 - \mu)^2`
+
+    With :math:`u_2 = 0` this reduces to the linear law, of which
+    :math:`u_1 = 0.6` is the Eddington approximation.
+
+    """
+    names = ("u_1", "u_2")
+
+    @staticmethod
+    def _basis(mu):
+        return 1 - mu, (1 - mu)**2
@@ -0,0 +1,16 @@
+import numpy as np
+
+from .law import Law
+
+
+class SquareRoot(Law):
+    r"""Square-root limb darkening law.
+
+    :math:`I(\mu)/I(1) = 1 - c (1 - \mu) - d (1 - \sqrt{\mu})`
+
+    """
+    names = ("c", "d")
+
+    @staticmethod
+    def _basis(mu):
+        return 1 - mu, 1 - np.sqrt(mu)
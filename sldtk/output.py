@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+FORMATS = ("input", "png", "jpg", "tiff", "npy", "raw")
+
+# Formats storing the unclipped floating point correction.
+FLOAT_FORMATS = ("npy", "raw")
+
+
+class ImageWriter(object):
+    """Encode and write images on a background thread pool.
+
+    The format is chosen by the file extension: ".npy" stores the array
+    with its shape and dtype, ".raw" stores the bare array data, and
+    anything else is encoded by OpenCV (which releases the GIL while
+    encoding, so several images are encoded in parallel).
+
+    Parameters
+    ----------
+    threads : int, optional
+        Number of encoding threads.
+    png_compression : int, optional
+        PNG compression level (0-9). By default OpenCV's own strategy is
+        used, which is considerably faster than any explicit level.
+    jpeg_quality : int, optional
+        JPEG quality (0-100), OpenCV's default (95) if omitted.
+
+    Notes
+    -----
+    Images are not copied, and must therefore not be modified until their
+    write has completed (see the future returned by `write`).
+
+    """
+    def __init__(self, threads=2, png_compression=None, jpeg_quality=None):
+        # Parameters are only passed when set, as passing any PNG
+        # compression level disables OpenCV's fast default strategy.
+        self.params = dict()
+        if png_compression is not None:
+            self.params[".png"] = [cv2.IMWRITE_PNG_COMPRESSION,
+                                   png_compression]
+        if jpeg_quality is not None:
+            self.params[".jpg"] = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+            self.params[".jpeg"] = self.params[".jpg"]
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._futures = list()
+        self._lock = threading.Lock()
+
+    def write(self, path, img, params=None):
+        """Queue an image to be written to `path`.
+
+        Parameters
+        ----------
+        path : str
+            Destination, whose extension determines the format.
+        img : numpy.ndarray
+            Image to write.
+        params : sequence of ints, optional
+            OpenCV encoding parameters overriding the writer's own.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to `path` once the image has been written.
+
+        """
+        future = self._pool.submit(self._write, path, img, params)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()
+                             or f.exception() is not None]
+            self._futures.append(future)
+        return future
+
+    def close(self):
+        """Wait for all queued writes to complete.
+
+        Raises
+        ------
+        IOError
+            If any of the images could not be written.
+
+        """
+        self._pool.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, path, img, params):
+        ext = os.path.splitext(path)[1].lower()
+        if params is None:
+            params = self.params.get(ext, [])
+        if ext == ".npy":
+            np.save(path, img)
+        elif ext == ".raw":
+            img.tofile(path)
+        elif not cv2.imwrite(path, img, list(params)):
+            raise IOError("Unable to write {}.".format(path))
+        return path
+
+
+class FrameStore(object):
+    """Store many frames of the same shape and dtype in chunked .npy files.
+
+    Frames are appended to memory mapped chunks of `chunk_size` frames
+    (``chunk_00000.npy``, ...), which avoids thousands of small files and
+    any encoding cost. An ``index.json`` keeps track of the frames' names,
+    and an existing store is appended to.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the store.
+    chunk_size : int, optional
+        Number of frames per chunk (for new stores).
+
+    """
+    def __init__(self, directory, chunk_size=64):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.json")
+        if os.path.isfile(self._index_path):
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"chunk_size": chunk_size, "shape": None,
+                          "dtype": None, "names": list()}
+        self._chunk = None
+        self._chunk_num = None
+
+    def __len__(self):
+        return len(self.index["names"])
+
+    def append(self, name, frame):
+        """Append a frame to the store.
+
+        Raises
+        ------
+        ValueError
+            If `frame` does not match the shape and dtype of the store.
+
+        """
+        if self.index["shape"] is None:
+            self.index["shape"] = list(frame.shape)
+            self.index["dtype"] = np.dtype(frame.dtype).str
+        elif (list(frame.shape) != self.index["shape"] or
+              np.dtype(frame.dtype) != np.dtype(self.index["dtype"])):
+            raise ValueError("Frame does not match the store's shape and "
+                             "dtype.")
+
+        chunk_num, i = divmod(len(self), self.index["chunk_size"])
+        self._open_chunk(chunk_num)
+        self._chunk[i] = frame
+        self.index["names"].append(name)
+        if i == self.index["chunk_size"] - 1:
+            self.flush()
+
+    def read(self, key):
+        """Read (memory map) a frame by its position or name."""
+        if not isinstance(key, int):
+            key = self.index["names"].index(key)
+        chunk_num, i = divmod(key, self.index["chunk_size"])
+        if chunk_num == self._chunk_num:
+            self._chunk.flush()
+        return np.load(self._chunk_path(chunk_num), mmap_mode="r")[i]
+
+    def flush(self):
+        """Write the current chunk and the index to disk."""
+        if self._chunk is not None:
+            self._chunk.flush()
+        with open(self._index_path, "w") as f:
+            json.dump(self.index, f)
+
+    def close(self):
+        self.flush()
+        self._chunk = None
+        self._chunk_num = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _chunk_path(self, chunk_num):
+        return os.path.join(self.directory,
+                            "chunk_{:05d}.npy".format(chunk_num))
+
+    def _open_chunk(self, chunk_num):
+        if chunk_num == self._chunk_num:
+            return
+        if self._chunk is not None:
+            self._chunk.flush()
+        path = self._chunk_path(chunk_num)
+        if os.path.isfile(path):
+            self._chunk = np.load(path, mmap_mode="r+")
+        else:
+            shape = (self.index["chunk_size"],) + tuple(self.index["shape"])
+            self._chunk = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.dtype(self.index["dtype"]),
+                shape=shape)
+        self._chunk_num = chunk_num
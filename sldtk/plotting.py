@@ -1,5 +1,9 @@
+import cv2
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 
 
 class Plotter(object):
@@ -11,11 +15,25 @@ class Plotter(object):
         Title used for the graph.
     out_path : str
         Default filepath for the graph.
+    headless : bool, optional
+        Render straight to an Agg canvas, bypassing pyplot and any GUI
+        backend. Headless plotters can only be saved, not shown.
+
+    Notes
+    -----
+    For batches, a single plotter can be reused for several images through
+    `reset`, which is considerably faster than creating a new figure per
+    image, particularly when saving with ``tight=False``.
 
     """
-    def __init__(self, img_name, out_path):
+    def __init__(self, img_name, out_path, headless=False):
         self.out_path = out_path
-        self.fig, self.ax = plt.subplots(figsize=(7, 7))
+        if headless:
+            self.fig = Figure(figsize=(7, 7))
+            FigureCanvasAgg(self.fig)
+            self.ax = self.fig.add_subplot(111)
+        else:
+            self.fig, self.ax = plt.subplots(figsize=(7, 7))
         self.ax.set_aspect('equal')
         self.ax.set_xlim(0, 1.025)
         self.ax.set_ylim(0, 1.025)  # Can be overridden by `plot_profile`.
@@ -24,11 +42,35 @@ class Plotter(object):
         self.ax.set_xlabel("Relative Distance From Centre")
         self.ax.set_ylabel("Relative Intensity")
         self.fig.subplots_adjust(top=0.94)
-        self.extra_artists = list()
-        self.extra_artists.append(self.fig.suptitle(
-            "{} - Intensity Profile".format(img_name), size=14))
+        self.title = self.fig.suptitle(
+            "{} - Intensity Profile".format(img_name), size=14)
+        self.extra_artists = [self.title]
         self.ax.grid(which="major", axis="both", linestyle='--', linewidth=1,
                      zorder=1)
+        self._artists = list()
+        self._legend = None
+
+    def reset(self, img_name, out_path):
+        """Clear all plotted data so the figure can be reused.
+
+        Parameters
+        ----------
+        img_name : str
+            Title used for the next graph.
+        out_path : str
+            Default filepath for the next graph.
+
+        """
+        for artist in self._artists:
+            artist.remove()
+        self._artists = list()
+        if self._legend is not None:
+            self._legend.remove()
+            self._legend = None
+        self.extra_artists = [self.title]
+        self.title.set_text("{} - Intensity Profile".format(img_name))
+        self.ax.set_ylim(0, 1.025)
+        self.out_path = out_path
 
     def plot_profile(self, profile, label="Profile", color='b', zorder=1):
         """Normalize an intensity profile and scatter-plot it.
@@ -62,11 +104,51 @@ class Plotter(object):
         if desired_axis_height > self.ax.get_ylim()[1]:
             self.ax.set_ylim((0, desired_axis_height))
 
-        self.ax.scatter(x, y, s=3, c=color,
-                        label=label,
-                        zorder=10+zorder)
+        self._artists.append(self.ax.scatter(x, y, s=3, c=color,
+                                             label=label,
+                                             zorder=10+zorder))
+
+    def plot_profiles(self, profiles, label="Profiles", color='b', alpha=0.1,
+                      zorder=1):
+        """Plot many normalized intensity profiles (e.g. of a whole run) as
+        lines in a single collection.
+
+        Parameters
+        ----------
+        profiles : iterable of numpy.ndarray
+            1-D intensity profiles to plot, which may differ in length.
+        label : optional
+            Custom plot label for the collection.
+        color : optional
+            Custom line color forwarded to the collection.
+        alpha : float, optional
+            Opacity of the individual lines.
+        zorder : optional
+            Z-order of the profiles (will be shifted up by 10 from given).
+
+        Notes
+        -----
+        See `plot_profile` for the normalization applied.
+
+        """
+        segments = list()
+        y_max = 0.
+        for profile in profiles:
+            y = profile / profile[0]
+            x = np.linspace(0., 1., num=len(profile))
+            segments.append(np.column_stack((x, y)))
+            y_max = max(y_max, y.max())
+
+        desired_axis_height = y_max + y_max*0.025
+        if desired_axis_height > self.ax.get_ylim()[1]:
+            self.ax.set_ylim((0, desired_axis_height))
+
+        lines = LineCollection(segments, colors=color, alpha=alpha,
+                               linewidths=1, label=label, zorder=10+zorder)
+        self._artists.append(self.ax.add_collection(lines))
 
-    def plot_model(self, name, model, zorder=1, color='r', linestyle='-'):
+    def plot_model(self, name, model, zorder=1, color='r', linestyle='-',
+                   num=700):
         """Add a plot of a model to the figure.
 
         Parameters
@@ -81,21 +163,22 @@ class Plotter(object):
             Custom line colour forwarded to matplotlib.pyplot.plot.
         linestyle : optional
             Custom line style forwarded to matplotlib.pyplot.plot.
+        num : int, optional
+            Number of points the model is evaluated at.
 
         """
-        x = np.linspace(0., 1., num=700)
+        x = np.linspace(0., 1., num=num)
         y = model.eval(x)
         label = r"{}: ${{{}}}$".format(name, model.coefs_str())
-        self.ax.plot(x, y, linewidth=2, c=color, label=label, zorder=20+zorder,
-                     linestyle=linestyle)
+        self._artists.extend(self.ax.plot(x, y, linewidth=2, c=color,
+                                          label=label, zorder=20+zorder,
+                                          linestyle=linestyle))
 
     def show(self):
-        self.extra_artists.append(self.ax.legend(loc='lower left',
-                                                 bbox_to_anchor=(0, 0),
-                                                 fontsize=11))
+        self._add_legend()
         plt.show()
 
-    def save(self, out_path=None, dpi=160):
+    def save(self, out_path=None, dpi=160, tight=True):
         """Save the graph with legends for the individual plots.
 
         Parameters
@@ -104,14 +187,84 @@ class Plotter(object):
             Can be used to override the class' default assigned output path.
         dpi : int, optional
             Dots per inch forwarded to matplotlib.pyplot.savefig.
+        tight : bool, optional
+            Crop the graph to its contents. This requires an extra layout
+            pass, and can be disabled to save time in batches.
 
         """
         if out_path is None:
             out_path = self.out_path
-        self.extra_artists.append(self.ax.legend(loc='lower left',
-                                                 bbox_to_anchor=(0, 0),
-                                                 fontsize=11))
-        self.fig.savefig(out_path, dpi=dpi,
-                         bbox_extra_artists=self.extra_artists,
-                         bbox_inches='tight')
+        self._add_legend()
+        if tight:
+            self.fig.savefig(out_path, dpi=dpi,
+                             bbox_extra_artists=self.extra_artists,
+                             bbox_inches='tight')
+        else:
+            self.fig.savefig(out_path, dpi=dpi)
+
+    def _add_legend(self):
+        if self._legend is not None:
+            self._legend.remove()
+            self.extra_artists.remove(self._legend)
+        self._legend = self.ax.legend(loc='lower left', bbox_to_anchor=(0, 0),
+                                      fontsize=11)
+        self.extra_artists.append(self._legend)
+
+
+RENDER_COLORS = ((0, 0, 255), (255, 255, 0), (0, 160, 0), (42, 42, 165))
+
+
+def render_profile(profile, models=(), size=512, margin=24):
+    """Draw an intensity profile and models into an image using OpenCV.
+
+    This is a lightweight alternative to `Plotter` for quick looks and
+    large batches, taking a fraction of a millisecond per plot.
+
+    Parameters
+    ----------
+    profile : numpy.ndarray
+        1-D intensity profile to plot (normalized as in
+        `Plotter.plot_profile`).
+    models : iterable of limb_model.LimbModel, optional
+        Models to draw as curves, in the colors of `RENDER_COLORS`.
+    size : int, optional
+        Width and height of the image.
+    margin : int, optional
+        Blank border around the graph.
+
+    Returns
+    -------
+    numpy.ndarray
+        BGR image of the graph.
+
+    """
+    img = np.full((size, size, 3), 255, dtype=np.uint8)
+    y = profile / profile[0]
+    x = np.linspace(0., 1., num=len(profile))
+    y_max = max(1.025, y.max() * 1.025)
+    extent = size - 2*margin
+
+    def to_px(x, y):
+        return np.column_stack((margin + x / 1.025 * extent,
+                                size - margin - y / y_max * extent)
+                               ).round().astype(np.int32)
+
+    for tick in np.arange(0., 1.1, 0.1):
+        px, py = (int(v) for v in to_px(np.array([tick]),
+                                        np.array([tick]))[0])
+        cv2.line(img, (px, margin), (px, size-margin), (220, 220, 220))
+        if tick <= y_max:
+            cv2.line(img, (margin, py), (size-margin, py), (220, 220, 220))
+    cv2.rectangle(img, (margin, margin), (size-margin, size-margin), (0, 0, 0))
+
+    points = to_px(x, y)
+    inside = ((points >= 0) & (points < size)).all(axis=1)
+    img[points[inside, 1], points[inside, 0]] = (255, 0, 0)
+
+    x_model = np.linspace(0., 1., num=extent)
+    for model, color in zip(models, RENDER_COLORS):
+        curve = to_px(x_model, model.eval(x_model))
+        cv2.polylines(img, [curve], False, color, thickness=2,
+                      lineType=cv2.LINE_AA)
+    return img
 
@@ -1,5 +1,9 @@
+import warnings
+
 import numpy as np
 
+from . import kernels
+
 
 def _polar_to_cart(r, theta, center):
 
@@ -8,29 +12,48 @@ def _polar_to_cart(r, theta, center):
     return x, y
 
 
-def extract_stack(img, disk_attr, num_slices):
+def extract_stack(img, disk_attr, num_slices, return_mask=False, jit=None,
+                  angles=None):
     """Extract a stack of radial slices from a disk.
 
     Parameters
     ----------
     img : numpy.ndarray
-        Image containing a full (solar) disk.
-    disk_attr : tuple of ints
+        Image containing a (solar) disk.
+    disk_attr : tuple of numbers
         Center coordinates and radius of the disk contained in `img` (x,y,r).
+        A fractional radius is rounded to the nearest pixel.
     num_slices : int
         Number of equally spaced radial slices to extract from the disk.
+    return_mask : bool, optional
+        Also return a mask of the stack's pixels that lie within `img`.
+    jit : bool, optional
+        Gather the pixels with the JIT compiled kernel (see `kernels`)
+        rather than through NumPy index arrays. By default the kernel is
+        used for grayscale images when Numba is available and the calling
+        thread is the main thread.
+    angles : numpy.ndarray, optional
+        Explicit angles (radians) of the slices to extract, overriding
+        `num_slices`.
 
     Returns
     -------
     stack: numpy.ndarray
         Stack of width `disk_attr[2]` (disk radius) and height `num_slices`.
         Slices are kept in order
+    valid : numpy.ndarray of bool
+        False for pixels of slices that extend beyond the edges of `img`
+        (only if `return_mask`).
 
     Notes
     -----
     The slices are stacked in order, going clockwise from positive horizontal.
     No interpolation is performed.
 
+    Pixels beyond the edges of `img` (for disks that are only partially
+    contained in the image) take the value of the nearest edge pixel, and
+    should be excluded through the returned mask.
+
     TODO
     ----
     Accuracy/"straightness" could potentially be improved by rounding rather
@@ -38,13 +61,33 @@ def extract_stack(img, disk_attr, num_slices):
 
     """
     x, y, r = disk_attr
+    r = int(round(r))
+    height, width = img.shape[:2]
+
+    if angles is None:
+        theta = np.linspace(0, 2*np.pi, num_slices)
+    else:
+        theta = np.asarray(angles, dtype=float)
+        num_slices = len(theta)
+
+    if img.ndim == 2 and kernels.use_jit(jit):
+        stack = np.empty((num_slices, r), dtype=img.dtype)
+        valid = np.empty((num_slices, r), dtype=bool)
+        kernels.extract_stack(img, x, y, r, np.cos(theta), np.sin(theta),
+                              stack, valid)
+        if return_mask:
+            return stack, valid
+        return stack
 
-    theta, radial = np.meshgrid(np.linspace(0, 2*np.pi, num_slices),
-                                np.arange(0, r))
+    theta, radial = np.meshgrid(theta, np.arange(0, r))
 
     x_cart, y_cart = _polar_to_cart(radial, theta, (x, y))
-    x_cart = x_cart.astype(int)
-    y_cart = y_cart.astype(int)
+    x_cart = np.floor(x_cart).astype(int)
+    y_cart = np.floor(y_cart).astype(int)
+    valid = ((x_cart >= 0) & (x_cart < width) &
+             (y_cart >= 0) & (y_cart < height))
+    np.clip(x_cart, 0, width-1, out=x_cart)
+    np.clip(y_cart, 0, height-1, out=y_cart)
 
     if img.ndim == 3:
         stack = img[y_cart, x_cart, :]
@@ -53,10 +96,344 @@ def extract_stack(img, disk_attr, num_slices):
         stack = img[y_cart, x_cart]
         stack = np.reshape(stack, (r, num_slices))
 
+    if return_mask:
+        return stack.swapaxes(0, 1), valid.swapaxes(0, 1)
     return stack.swapaxes(0, 1)
 
 
-def clean_stack(stack, m=1.):
+def adaptive_stack(img, disk_attr, model, tolerance=1e-3, min_slices=64,
+                   max_slices=4096, params=None, method="mad",
+                   per_pixel=False, estimator="median", jit=None):
+    """Extract just enough slices for the fitted model to converge.
+
+    Slices are extracted in batches that double the size of the stack,
+    with each batch interleaved halfway between the slices extracted so
+    far (so the stack always covers the disk evenly). After each batch the
+    profile is compressed and `model` refitted, and extraction stops once
+    no coefficient changes by more than `tolerance`.
+
+    Slice means (for rejecting slices) are only computed for the new
+    slices (unless the first slices leaving the image are among them,
+    from which on all means are normalized per radius), and with the
+    "weighted_mean" estimator the column sums are updated with just the
+    slices whose rejection changed. Medians and per-pixel rejection depend
+    on all slices, and are recomputed over the whole stack after every
+    batch.
+
+    Parameters
+    ----------
+    img : numpy.ndarray
+        Image containing a (solar) disk.
+    disk_attr : tuple of ints
+        Center coordinates and radius of the disk contained in `img` (x,y,r).
+    model : limb_model.LimbModel
+        Model used to judge convergence (left fitted to the final profile).
+    tolerance : float, optional
+        Largest change of any coefficient considered converged.
+    min_slices : int, optional
+        Size of the first batch.
+    max_slices : int, optional
+        Upper limit on the number of slices.
+    params : optional
+        Model parameters, forwarded to `model.fit`.
+    method, per_pixel : optional
+        Outlier rejection settings, see `reject_outliers`.
+    estimator : str, optional
+        Profile estimator, see `compress_stack`.
+    jit : bool, optional
+        See `extract_stack`.
+
+    Returns
+    -------
+    stack : numpy.ndarray
+        The extracted stack, whose length is the number of slices needed.
+        Slices are ordered by batch rather than by angle.
+    valid : numpy.ndarray of bool
+        Mask of the stack's pixels that lie within `img`.
+    mask : numpy.ndarray of bool
+        Final rejection mask, see `reject_outliers`.
+    profile : numpy.ndarray
+        The profile `model` has been fitted to.
+    variance : numpy.ndarray or None
+        Variance of `profile`, with which the fit was weighted (only for
+        the "weighted_mean" estimator).
+
+    Notes
+    -----
+    As the stack doubles with every batch, the total work is at most twice
+    that of processing the final stack once.
+
+    """
+    angles = np.linspace(0, 2*np.pi, min(min_slices, max_slices),
+                         endpoint=False)
+    stack, valid = extract_stack(img, disk_attr, None, return_mask=True,
+                                 jit=jit, angles=angles)
+    # Slices are judged on means normalized per radius once some of them
+    # leave the image, see `reject_outliers`.
+    scale = None if per_pixel or valid.all() else _radial_scale(stack, valid)
+    row_means = None if per_pixel else _row_means(stack, valid, scale)
+    running = estimator == "weighted_mean" and not per_pixel
+    kept = np.zeros(0, dtype=bool)
+    sums = None
+    previous = None
+    while True:
+        mask = reject_outliers(stack, method=method, per_pixel=per_pixel,
+                               valid=valid, row_means=row_means)
+        variance = None  # Keep median fits anchored to the center.
+        if running:
+            # Kept slices contribute their valid pixels to the sums.
+            now_kept = mask if mask.ndim == 1 else mask.any(axis=1)
+            was_kept = np.zeros(len(stack), dtype=bool)
+            was_kept[:len(kept)] = kept
+            added = np.flatnonzero(now_kept & ~was_kept)
+            removed = np.flatnonzero(was_kept & ~now_kept)
+            delta = _moment_sums(stack[added], valid[added])
+            if sums is None:
+                sums = delta
+            else:
+                sums = [s + d for s, d in zip(sums, delta)]
+            if len(removed):
+                sums = [s - d for s, d in zip(
+                    sums, _moment_sums(stack[removed], valid[removed]))]
+            kept = now_kept
+
+            intensity_profile, variance = _stack_moments(stack, mask, sums,
+                                                         valid=valid)
+            inner = round(stack.shape[1] * INNER_REGION)
+            intensity_profile[0], variance[0] = _inverse_variance_mean(
+                intensity_profile[1:inner], variance[1:inner])
+        elif estimator == "weighted_mean":
+            intensity_profile, variance = compress_stack(
+                stack, mask=mask, estimator=estimator, return_variance=True,
+                valid=valid)
+        else:
+            intensity_profile = compress_stack(stack, mask=mask,
+                                               estimator=estimator,
+                                               valid=valid)
+        model.fit(intensity_profile, params, variance=variance)
+        coefs = np.asarray(model.coefs, dtype=float)
+        converged = (previous is not None and
+                     np.abs(coefs - previous).max() <= tolerance)
+        if converged or len(stack) >= max_slices:
+            break
+        previous = coefs
+
+        # Interleave the next batch halfway between the current slices.
+        num_new = min(len(stack), max_slices - len(stack))
+        gaps = np.linspace(0, len(stack), num_new, endpoint=False).astype(int)
+        angles = (gaps + 0.5) * (2*np.pi / len(stack))
+        new_stack, new_valid = extract_stack(img, disk_attr, None,
+                                             return_mask=True, jit=jit,
+                                             angles=angles)
+        stack = np.concatenate((stack, new_stack))
+        valid = np.concatenate((valid, new_valid))
+        if row_means is not None and scale is None and not new_valid.all():
+            scale = _radial_scale(stack, valid)
+            row_means = _row_means(stack, valid, scale)
+        elif row_means is not None:
+            row_means = np.concatenate((
+                row_means, _row_means(new_stack, new_valid, scale)))
+    return stack, valid, mask, intensity_profile, variance
+
+
+def _row_means(stack, valid=None, scale=None):
+    """Mean average of the (valid) pixels of each slice (row), with every
+    column divided by its entry of `scale` if given."""
+    if scale is None and (valid is None or np.all(valid)):
+        return stack.mean(axis=tuple(range(1, stack.ndim)))
+    if valid is None:
+        valid = np.ones(stack.shape[:2], dtype=bool)
+    if scale is None:
+        scale = np.ones(stack.shape[1])
+    count = valid.sum(axis=1) * np.prod(stack.shape[2:], dtype=int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.einsum("ij,ij...,j->i", valid, stack, 1. / scale,
+                         dtype=float) / count
+
+
+REJECTION_METHODS = ("mad", "percentile", "sigma_clip")
+
+DEFAULT_THRESHOLDS = {
+    "mad": 1.,
+    "sigma_clip": 3.,
+}
+
+# Individual pixels scatter far more than slice means, so they are judged
+# with wider thresholds.
+PIXEL_THRESHOLDS = {
+    "mad": 3.,
+    "sigma_clip": 3.,
+}
+
+# Number of stack elements per block of columns judged at a time.
+_BLOCK_SIZE = 2**18
+
+
+def reject_outliers(stack, method="mad", m=None, per_pixel=False,
+                    percentiles=(30, 70), max_iter=5, valid=None,
+                    row_means=None):
+    """Flag the slices (rows) or pixels of a stack that are not outliers.
+
+    Parameters
+    ----------
+    stack : numpy.ndarray
+        Radial slices stacked as rows.
+    method : {"mad", "percentile", "sigma_clip"}, optional
+        Rejection strategy, see notes below.
+    m : float, optional
+        Exclusion threshold in units of the median absolute deviation
+        ("mad") or standard deviation ("sigma_clip"). Defaults to the
+        method's entry in `DEFAULT_THRESHOLDS`, or in `PIXEL_THRESHOLDS`
+        if `per_pixel`.
+    per_pixel : bool, optional
+        Judge every pixel against the other pixels at the same radius
+        rather than every slice by its mean. This allows sunspots to be
+        rejected without discarding the rest of their slices.
+    percentiles : tuple of 2 numbers, optional
+        Lower and upper percentile kept by the "percentile" method.
+    max_iter : int, optional
+        Maximum number of clipping iterations for "sigma_clip".
+    valid : numpy.ndarray of bool, optional
+        Pixels to consider at all (as returned by `extract_stack`); invalid
+        pixels are left out of the statistics and always rejected.
+    row_means : numpy.ndarray, optional
+        Mean of the valid pixels of each slice (normalized per radius if
+        some pixels are not `valid`, see notes below), if already known
+        (e.g. accumulated while extracting slices in batches). Only used
+        when judging slices.
+
+    Returns
+    -------
+    mask : numpy.ndarray of bool
+        True for the rows (shape ``(len(stack),)``) or pixels (shape
+        ``stack.shape[:2]``, if `per_pixel` or some pixels are not `valid`)
+        to keep.
+
+    Raises
+    ------
+    ValueError
+        If `method` is unknown.
+
+    Notes
+    -----
+    "mad" uses http://www.itl.nist.gov/div898/handbook/eda/section3/eda35h.htm
+    through http://stackoverflow.com/questions/11686720/is-there-a-numpy-
+    builtin-to-reject-outliers-from-a-list. "percentile" keeps values
+    between `percentiles`, and "sigma_clip" iteratively rejects values more
+    than `m` standard deviations from the mean of the values kept so far.
+
+    Slices of a partially contained disk cover different ranges of radii,
+    so their means would mostly reflect how far they reach towards the
+    (dark) limb. They are therefore judged by the mean of their valid
+    pixels divided by the median of the valid pixels at the same radius.
+
+    All statistics are computed along the first axis, so the same code
+    serves both slice means and the pixel columns of the stack, and no
+    cleaned copy of the stack is made. Pixels are judged in blocks of
+    columns, so only block sized floating point copies of the stack are
+    ever made.
+
+    """
+    if method not in REJECTION_METHODS:
+        raise ValueError("Unknown rejection method {}.".format(method))
+    if m is None:
+        m = (PIXEL_THRESHOLDS if per_pixel else DEFAULT_THRESHOLDS).get(method)
+
+    partial = valid is not None and not np.all(valid)
+    if per_pixel:
+        mask = np.empty(stack.shape[:2], dtype=bool)
+        step = max(1, _BLOCK_SIZE // max(len(stack), 1))
+        for start in range(0, stack.shape[1], step):
+            cols = slice(start, start + step)
+            values = _float_columns(stack, cols, valid if partial else None)
+            mask[:, cols] = _reject_quietly(values, method, m, percentiles,
+                                            max_iter, nan_aware=partial)
+        return mask
+
+    if row_means is None:
+        if partial:
+            row_means = _row_means(stack, valid, _radial_scale(stack, valid))
+        else:
+            row_means = _row_means(stack)
+    mask = _reject_quietly(row_means, method, m, percentiles, max_iter,
+                           nan_aware=partial)
+    if partial:
+        mask = _expand_mask(mask, valid) & valid
+    return mask
+
+
+def _float_columns(stack, cols, valid=None):
+    """Floating point copy of the columns `cols` of a stack, with color
+    channels averaged and pixels that are not `valid` set to nan."""
+    values = stack[:, cols].astype(float)
+    if values.ndim > 2:
+        values = values.mean(axis=-1)  # Collapse color channels.
+    if valid is not None:
+        values[~valid[:, cols]] = np.nan
+    return values
+
+
+def _radial_scale(stack, valid):
+    """Median of the valid pixels of each column, or 1 where there are
+    none (or the median is 0)."""
+    scale = np.empty(stack.shape[1])
+    step = max(1, _BLOCK_SIZE // max(len(stack), 1))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-nan columns.
+        for start in range(0, stack.shape[1], step):
+            cols = slice(start, start + step)
+            scale[cols] = np.nanmedian(_float_columns(stack, cols, valid),
+                                       axis=0)
+    scale[~(scale > 0)] = 1.
+    return scale
+
+
+def _reject_quietly(values, method, m, percentiles, max_iter, nan_aware):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-nan columns.
+        with np.errstate(invalid='ignore'):
+            return _reject(values, method, m, percentiles, max_iter,
+                           nan_aware)
+
+
+def _reject(values, method, m, percentiles, max_iter, nan_aware):
+    median = np.nanmedian if nan_aware else np.median
+    if method == "mad":
+        ad = np.abs(values - median(values, axis=0))  # Absolute deviation.
+        mad = median(ad, axis=0)
+        # Keep everything if mad is 0 (but still drop nans).
+        s = np.where(mad != 0, ad / np.where(mad != 0, mad, 1.), ad * 0.)
+        return s < m
+    elif method == "percentile":
+        percentile = np.nanpercentile if nan_aware else np.percentile
+        low, high = percentile(values, percentiles, axis=0)
+        return np.logical_and(values >= low, values <= high)
+    else:
+        return _sigma_clip(values, m, max_iter)
+
+
+def _sigma_clip(values, m, max_iter):
+    mask = np.isfinite(values)
+    for _ in range(max_iter):
+        count = np.maximum(mask.sum(axis=0), 1)
+        mean = np.where(mask, values, 0.).sum(axis=0) / count
+        dev = values - mean
+        std = np.sqrt(np.where(mask, np.square(dev), 0.).sum(axis=0) / count)
+        clipped = np.abs(dev) <= m * std
+        if np.array_equal(clipped, mask):
+            break
+        mask = clipped
+    return mask
+
+
+def _expand_mask(mask, stack):
+    """Broadcast a row or pixel mask to the shape of `stack`."""
+    mask = np.asarray(mask, dtype=bool)
+    mask = mask.reshape(mask.shape + (1,) * (stack.ndim - mask.ndim))
+    return np.broadcast_to(mask, stack.shape)
+
+
+def clean_stack(stack, m=None, method="mad"):
     """Reject outlier slices (noisy rows) from a stack.
 
     Parameters
@@ -64,7 +441,9 @@ def clean_stack(stack, m=1.):
     stack : numpy.ndarray
         Radial slices stacked as rows.
     m : int, optional
-        Exclusion threshold. See notes below for more information.
+        Exclusion threshold, see `reject_outliers`.
+    method : str, optional
+        Rejection strategy, see `reject_outliers`.
 
     Returns
     -------
@@ -73,29 +452,21 @@ def clean_stack(stack, m=1.):
 
     Notes
     -----
-    Uses http://www.itl.nist.gov/div898/handbook/eda/section3/eda35h.htm
-    through http://stackoverflow.com/questions/11686720/is-there-a-numpy-
-    builtin-to-reject-outliers-from-a-list
-
-    TODO
-    ----
-    Consider user selectable mode (MAD & percentile).
+    This makes a copy of the kept slices; prefer passing the mask from
+    `reject_outliers` to `compress_stack` for large stacks.
 
     """
-    avg = stack.mean(axis=1)  # Mean average of each slice (row).
-    ad = np.abs(avg - np.median(avg))  # Absolute deviation from median.
-    mad = np.median(ad)
-    s = ad/mad if mad else 0.
-    stack = stack[s < m]
+    return stack[reject_outliers(stack, method=method, m=m)]
+
 
-    #  Alternative percentile approach kept for future testing:
-    # avg = stack.mean(axis=1)
-    # percentiles = np.percentile(avg, (30, 70))
-    # mask = np.logical_and(avg >= percentiles[0], avg <= percentiles[1])
-    return stack
+ESTIMATORS = ("median", "weighted_mean")
 
+# Fraction of the profile from which the center intensity is estimated.
+INNER_REGION = 0.2
 
-def compress_stack(stack, inner_region=0.2):
+
+def compress_stack(stack, inner_region=INNER_REGION, mask=None,
+                   estimator="median", return_variance=False, valid=None):
     """Derive an average intensity profile (slice) from the entire stack.
 
     Parameters
@@ -105,11 +476,29 @@ def compress_stack(stack, inner_region=0.2):
     inner_region : float, optional
         Fraction of the profile (from disk center) that should be used in
         estimating the center intensity.
+    mask : numpy.ndarray of bool, optional
+        Row or pixel mask (as returned by `reject_outliers`) of the values
+        to use; all values are used if omitted.
+    estimator : {"median", "weighted_mean"}, optional
+        How the values at each radius are averaged, see notes below.
+    return_variance : bool, optional
+        Also return the variance of the profile's values.
+    valid : numpy.ndarray of bool, optional
+        Pixels that lie within the image (as returned by `extract_stack`),
+        to which radii where `mask` rejects everything fall back.
 
     Returns
     -------
     profile : numpy.ndarray
         An average intensity profile from the sun's center to its limb.
+    variance : numpy.ndarray
+        Variance of each element of `profile` as an estimate of the mean
+        intensity at its radius (only if `return_variance`).
+
+    Raises
+    ------
+    ValueError
+        If `estimator` is unknown.
 
     Notes
     -----
@@ -120,16 +509,137 @@ def compress_stack(stack, inner_region=0.2):
     between the local minima and maxima, which would be likely to lead to
     skewed results for subsequent analysis (e.g. model fitting).
 
-    TODO
-    ----
-    Center value should arguably be substituted through a weighted average
-    since variance is lower towards the center?
+    The "median" estimator uses the median of each column and of the inner
+    region, while "weighted_mean" averages the unmasked pixels of each
+    column and substitutes the center with the inverse-variance weighted
+    average of the inner region's columns. The latter only needs running
+    sums over the stack, and is therefore considerably faster for pixel
+    masks. The variance of a median is approximated by pi/2 times the
+    variance of the mean.
+
+    Radii at which every pixel has been rejected by `mask` fall back to
+    using all `valid` pixels (all pixels if `valid` is omitted), and are
+    nan if none is valid.
 
     """
-    profile = np.median(stack, axis=0)
-    slice_size = len(profile)
+    if estimator not in ESTIMATORS:
+        raise ValueError("Unknown estimator {}.".format(estimator))
+
+    slice_size = stack.shape[1]
     inner = round(slice_size * inner_region)
-    profile[0] = np.median(stack[:, 1:inner])
 
+    if estimator == "median":
+        profile = _masked_median(stack, mask, valid=valid)
+        profile[0] = _masked_median(
+            stack[:, 1:inner],
+            None if mask is None else _expand_mask(mask, stack)[:, 1:inner],
+            axis=None, valid=None if valid is None else valid[:, 1:inner])
+    if return_variance or estimator == "weighted_mean":
+        mean, variance = _stack_moments(stack, mask, valid=valid)
+        if estimator == "weighted_mean":
+            profile = mean
+        else:
+            variance = variance * (np.pi / 2)
+        center, variance[0] = _inverse_variance_mean(profile[1:inner],
+                                                     variance[1:inner])
+        if estimator == "weighted_mean":
+            profile[0] = center
+
+    if return_variance:
+        return profile, variance
     return profile
 
+
+def _masked_median(stack, mask, axis=0, valid=None):
+    """Median of the unmasked values, falling back to the `valid` values
+    (or all values) where every value is masked."""
+    if mask is None:
+        if valid is None:
+            return np.median(stack, axis=axis)
+        mask = valid
+    masked = np.ma.masked_array(stack, mask=~_expand_mask(mask, stack))
+    median = np.ma.median(masked, axis=axis)
+    if axis is None:
+        if median is not np.ma.masked:
+            return median
+        if valid is None:
+            return np.median(stack)
+        if not np.any(valid):
+            return np.nan
+        return _masked_median(stack, valid, axis=None)
+    rejected = np.ma.getmaskarray(median)
+    median = np.ma.getdata(median).astype(float)
+    if rejected.any():
+        fallback = stack[:, rejected]
+        if valid is None:
+            median[rejected] = np.median(fallback, axis=axis)
+        else:
+            fallback = np.ma.masked_array(
+                fallback, mask=~_expand_mask(valid[:, rejected], fallback))
+            median[rejected] = np.ma.median(fallback, axis=axis).filled(
+                np.nan)
+    return median
+
+
+def _stack_moments(stack, mask, sums=None, valid=None):
+    """Mean of the unmasked values of each column and its variance, from
+    `sums` (as returned by `_moment_sums`) if they are already known.
+
+    Columns without unmasked values fall back to their `valid` values (or
+    all values), and are nan if there are none.
+
+    """
+    if sums is None:
+        sums = _moment_sums(stack, mask)
+    count, total, squares = (np.array(s, dtype=float) for s in sums)
+
+    empty = count == 0
+    if empty.any():
+        count[empty], total[empty], squares[empty] = _moment_sums(
+            stack[:, empty], None if valid is None else valid[:, empty])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        sample_var = (squares - count * np.square(mean)) / (count - 1)
+        variance = np.maximum(sample_var, 0.) / count
+    return mean, variance
+
+
+def _moment_sums(stack, mask):
+    """Count, sum and sum of squares of the unmasked values of each column.
+
+    The sums are accumulated in a single pass over blocks of rows, with the
+    mask applied to each block.
+
+    """
+    if mask is None:
+        count = np.full(stack.shape[1], len(stack), dtype=float)
+    elif mask.ndim == 1:
+        count = np.full(stack.shape[1], np.count_nonzero(mask), dtype=float)
+    else:
+        count = np.count_nonzero(mask, axis=0).astype(float)
+
+    total = np.zeros(stack.shape[1])
+    squares = np.zeros(stack.shape[1])
+    step = max(1, _BLOCK_SIZE // max(stack.shape[1], 1))
+    for start in range(0, len(stack), step):
+        block = stack[start:start + step].astype(float)
+        if mask is not None:
+            block *= _expand_mask(mask[start:start + step], block)
+        total += block.sum(axis=0)
+        squares += np.einsum("ij,ij->j", block, block)
+    return count, total, squares
+
+
+def _inverse_variance_mean(values, variance):
+    """Inverse-variance weighted average of `values` and its variance."""
+    valid = np.isfinite(variance)
+    if not valid.any():
+        return values.mean(), np.nan
+    values = values[valid]
+    variance = variance[valid]
+    positive = variance > 0
+    if not positive.any():
+        return values.mean(), 0.
+    weights = 1. / np.maximum(variance, variance[positive].min())
+    return (weights * values).sum() / weights.sum(), 1. / weights.sum()
@@ -0,0 +1,238 @@
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from . import correction
+from . import detection
+from . import models
+from . import profile
+
+COMBINE_METHODS = ("median", "weighted_mean")
+
+
+class Reference(object):
+    """A limb darkening model fitted to the combined profiles of many frames.
+
+    Frames taken close in time with the same instrument share their limb
+    darkening, so combining their profiles gives a far less noisy model
+    than any single frame. Use `build_reference` to create one.
+
+    Attributes
+    ----------
+    profile : numpy.ndarray
+        Combined profile, relative to the center intensity, sampled at
+        equally spaced relative distances from the center to the limb.
+    variance : numpy.ndarray
+        Variance of each element of `profile`.
+    model : limb_model.LimbModel
+        Model fitted to `profile` (with a center intensity of 1).
+    frames : list of dict
+        The "name", "disk_attr" and center intensity "i_0" of each frame.
+    lut : numpy.ndarray
+        Lookup table of `model`, shared by all corrections.
+
+    """
+    def __init__(self, intensity_profile, variance, model, frames,
+                 lut=None):
+        self.profile = intensity_profile
+        self.variance = variance
+        self.model = model
+        self.frames = frames
+        self.lut = model.lut() if lut is None else model.lut(lut)
+
+    def correct(self, img, disk_attr, i_0, bias, **kwargs):
+        """Flat field correct a frame with the reference model.
+
+        Parameters
+        ----------
+        img : numpy.ndarray
+            Greyscale image containing a solar disk.
+        disk_attr : tuple of 3 ints
+            The x, y and r properties of the solar disk present in the image.
+        i_0 : float
+            Center intensity of the frame, to which the relative model is
+            scaled.
+        bias : int or float
+            Brightness level of the disk's centre.
+        **kwargs
+            Forwarded to `correction.correct_disk`.
+
+        Returns
+        -------
+        numpy.ndarray
+            Flat field corrected version of `img`.
+
+        """
+        model = copy.copy(self.model)  # Keep the shared model untouched.
+        model.i_0 = i_0
+        return correction.correct_disk(img, disk_attr, bias, model,
+                                       lut=self.lut, **kwargs)
+
+    def corrected_frames(self, images, bias, pool=None, **kwargs):
+        """Correct the frames the reference was built from.
+
+        Parameters
+        ----------
+        images : list of str or numpy.ndarray
+            The images passed to `build_reference`, in the same order.
+        bias : int or float
+            Brightness level of the disk's centre.
+        pool : correction.BufferPool, optional
+            Pool of output buffers, see `correction.correct_stream`.
+        **kwargs
+            Forwarded to `correction.correct_disk`.
+
+        Yields
+        ------
+        name : str
+            Name of the frame.
+        corrected : numpy.ndarray
+            The corrected frame, whose buffer is recycled when the next
+            frame is requested.
+
+        """
+        if pool is None:
+            pool = correction.BufferPool()
+        for image, frame in zip(images, self.frames):
+            img = _load(image)
+            out = pool.get(img.shape, img.dtype)
+            try:
+                yield frame["name"], self.correct(img, frame["disk_attr"],
+                                                  frame["i_0"], bias, out=out,
+                                                  **kwargs)
+            finally:
+                pool.release(out)
+
+
+def build_reference(images, model="polynomial", params=None, threshold=10,
+                    num_slices=1000, detection_method="mec", method="mad",
+                    per_pixel=False, estimator="median", combine="median",
+                    grid_size=512, threads=None, lut=None):
+    """Build a reference model from the combined profiles of many frames.
+
+    Parameters
+    ----------
+    images : list of str or numpy.ndarray
+        Paths to, or greyscale arrays of, frames of the same instrument and
+        epoch.
+    model : str, optional
+        Name of the model to fit (a key of `models.models`).
+    params : optional
+        Model parameters, forwarded to `fit`.
+    threshold : int or str, optional
+        Disk threshold, see `detection.detect_disk`.
+    num_slices : int, optional
+        Number of slices extracted per frame.
+    detection_method : str, optional
+        See `detection.detect_disk`.
+    method, per_pixel : optional
+        Outlier rejection settings, see `profile.reject_outliers`.
+    estimator : str, optional
+        Per frame profile estimator, see `profile.compress_stack`.
+    combine : {"median", "weighted_mean"}, optional
+        How the frames' profiles are combined, see notes below.
+    grid_size : int, optional
+        Number of equally spaced relative distances the frames' profiles
+        are resampled to.
+    threads : int, optional
+        Number of frames processed in parallel. None uses the default of
+        `concurrent.futures.ThreadPoolExecutor`.
+    lut : int, optional
+        Size of the reference's lookup table.
+
+    Returns
+    -------
+    Reference
+        The combined profile and the model fitted to it.
+
+    Raises
+    ------
+    ValueError
+        If `combine` is unknown or no images are given.
+
+    Notes
+    -----
+    As disk radii differ slightly between frames, every profile is
+    normalized by its center intensity and linearly resampled to a common
+    grid of relative distances before combining. "median" takes the median
+    of each grid point, while "weighted_mean" rejects outlying values
+    (3 MADs from the median) and averages the remaining ones weighted by
+    the inverse of their variance.
+
+    """
+    if combine not in COMBINE_METHODS:
+        raise ValueError("Unknown combine method {}.".format(combine))
+    if not len(images):
+        raise ValueError("No images to build a reference from.")
+
+    def process(image):
+        return _frame_profile(_load(image), threshold, num_slices,
+                              detection_method, method, per_pixel, estimator)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(process, images))
+
+    grid = np.linspace(0., 1., num=grid_size)
+    profiles = np.empty((len(results), grid_size))
+    variances = np.empty((len(results), grid_size))
+    frames = list()
+    for i, (image, (disk_attr, frame_profile, variance)) in enumerate(
+            zip(images, results)):
+        i_0 = frame_profile[0]
+        x = np.linspace(0., 1., num=len(frame_profile))
+        profiles[i] = np.interp(grid, x, frame_profile / i_0)
+        variances[i] = np.interp(grid, x, variance / i_0**2)
+        name = image if isinstance(image, str) else str(i)
+        frames.append({"name": os.path.basename(name), "disk_attr": disk_attr,
+                       "i_0": i_0})
+
+    if combine == "median":
+        combined = np.median(profiles, axis=0)
+        # Variance of the median of the frames, as in compress_stack.
+        spread = profiles.var(axis=0, ddof=1) if len(profiles) > 1 else \
+            variances[0]
+        combined_var = spread * (np.pi / 2) / len(profiles)
+    else:
+        keep = profile.reject_outliers(profiles, method="mad", m=3.,
+                                       per_pixel=True)
+        with np.errstate(divide='ignore'):
+            weights = np.where(keep, 1. / variances, 0.)
+        weights[~np.isfinite(weights)] = 0.
+        total = weights.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            combined = (weights * profiles).sum(axis=0) / total
+            combined_var = 1. / total
+        fallback = total == 0
+        combined[fallback] = np.median(profiles[:, fallback], axis=0)
+        combined_var[fallback] = np.nan
+
+    fitted = models.models[model]()
+    fitted.fit(combined, params, variance=combined_var)
+    return Reference(combined, combined_var, fitted, frames, lut=lut)
+
+
+def _load(image):
+    if isinstance(image, str):
+        img = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise TypeError(
+                "{} not recognized as a jpg or png image.".format(image))
+        return img
+    return image
+
+
+def _frame_profile(img, threshold, num_slices, detection_method, method,
+                   per_pixel, estimator):
+    """Detect the disk of a frame and derive its profile and variance."""
+    disk_attr = detection.detect_disk(img, threshold, method=detection_method)
+    stack, valid = profile.extract_stack(img, disk_attr, num_slices,
+                                         return_mask=True)
+    mask = profile.reject_outliers(stack, method=method, per_pixel=per_pixel,
+                                   valid=valid)
+    intensity_profile, variance = profile.compress_stack(
+        stack, mask=mask, estimator=estimator, return_variance=True,
+        valid=valid)
+    return disk_attr, intensity_profile, variance
@@ -9,10 +9,13 @@ Change all single quotes to double quotes.
 import os
 
 import cv2
+import numpy as np
 
 from . import correction
+from . import database
 from . import detection
 from . import models
+from . import output
 from . import plotting
 from . import profile
 from .helpers import (
@@ -26,21 +29,43 @@ config = {
     "debug": False,
     "operations": ['all', 'correct', 'model'],
     "threshold": 10,
+    "detection": list(detection.DETECTION_METHODS),
     "slices": 1000,
+    "adaptive": None,
     "bias": 175,
+    "rejection": list(profile.REJECTION_METHODS),
+    "per_pixel": False,
+    "estimator": list(profile.ESTIMATORS),
+    "lut": None,
+    "threads": 1,
     "models": list(models.models.keys()),
     "reference_models": list(models.reference_models.keys()),
     "plot_correction": True,
     "interactive_plot": False,
+    "format": list(output.FORMATS),
+    "png_compression": None,
+    "jpeg_quality": None,
+    "writer_threads": 2,
     "out_dir": "./out",
     "debug_dir": None,
+    "database": None,
     "separate_dir": True,
 }
 
+# Encoding of the (lossy, fast) debug overlay.
+DEBUG_PARAMS = {
+    ".jpg": (cv2.IMWRITE_JPEG_QUALITY, 50),
+    ".jpeg": (cv2.IMWRITE_JPEG_QUALITY, 50),
+    ".png": (cv2.IMWRITE_PNG_COMPRESSION, 6),
+}
+
 
 def main():
     args = parse_input(config)
     paths = generate_output_paths(args)
+    writer = output.ImageWriter(threads=args['writer_threads'],
+                                png_compression=args['png_compression'],
+                                jpeg_quality=args['jpeg_quality'])
 
     image = cv2.imread(args['image'])
     if image is None:
@@ -53,50 +78,94 @@ def main():
         gray = image.copy()
 
     # Detect the solar disk.
-    disk_attr = detection.detect_disk(gray, args['threshold'])
+    disk_attr, threshold = detection.detect_disk(gray, args['threshold'],
+                                                 method=args['detection'],
+                                                 return_threshold=True)
     if args['debug']:
+        print("Threshold: {}".format(threshold))
         print("MEC x: {}, y: {}, r: {}".format(disk_attr[0], disk_attr[1],
                                                disk_attr[2]))
         image = overlay_mec(image, disk_attr)
-        cv2.imwrite(paths["mec"], image, (cv2.IMWRITE_JPEG_QUALITY, 50,
-                                          cv2.IMWRITE_PNG_COMPRESSION, 6))
-
-    # Create the slice stack.
-    stack = profile.extract_stack(gray, disk_attr, args['slices'])
-    stack_clean = profile.clean_stack(stack)
-    # Average the stack to create an intensity profile.
-    intensity_profile = profile.compress_stack(stack_clean)
+        ext = os.path.splitext(paths["mec"])[1].lower()
+        writer.write(paths["mec"], image, DEBUG_PARAMS.get(ext))
+
+    # Create the slice stack, average it into an intensity profile and fit
+    # the model to it.
+    model = models.models[args["model"]]()
+    if args['adaptive'] is None:
+        stack, valid = profile.extract_stack(gray, disk_attr, args['slices'],
+                                             return_mask=True)
+        mask = profile.reject_outliers(stack, method=args['rejection'],
+                                       per_pixel=args['per_pixel'],
+                                       valid=valid)
+        variance = None  # Keep median fits anchored to the center.
+        if args['estimator'] == "weighted_mean":
+            intensity_profile, variance = profile.compress_stack(
+                stack, mask=mask, estimator=args['estimator'],
+                return_variance=True, valid=valid)
+        else:
+            intensity_profile = profile.compress_stack(
+                stack, mask=mask, estimator=args['estimator'], valid=valid)
+        model.fit(intensity_profile, args["model_parameter"],
+                  variance=variance)
+    else:
+        stack, valid, mask, intensity_profile, _ = profile.adaptive_stack(
+            gray, disk_attr, model, tolerance=args['adaptive'],
+            max_slices=args['slices'], params=args["model_parameter"],
+            method=args['rejection'], per_pixel=args['per_pixel'],
+            estimator=args['estimator'])
+        print("Slices needed: {}".format(len(stack)))
+
     if args['debug']:
         print("Slices: {}".format(len(stack)))
-        print("Slices dropped: {}".format(len(stack) - len(stack_clean)))
+        if mask.ndim == 1:
+            print("Slices dropped: {}".format((~mask).sum()))
+            stack_clean = stack[mask]
+        else:
+            print("Pixels rejected: {}".format((~mask).sum()))
+            stack_clean = stack * mask
         stack = cv2.cvtColor(stack, cv2.COLOR_GRAY2BGR)
         stack = cv2.line(stack, (disk_attr[2]-1, 0),
                          (disk_attr[2]-1, stack.shape[0]), (0, 255, 0))
-        cv2.imwrite(paths['stack'], stack)
+        writer.write(paths['stack'], stack)
         print("Slice stack saved to {}".format(paths['stack']))
         stack_clean = cv2.cvtColor(stack_clean, cv2.COLOR_GRAY2BGR)
         stack_clean = cv2.line(stack_clean, (disk_attr[2]-1, 0),
                                (disk_attr[2]-1, stack_clean.shape[0]),
                                (0, 255, 0))
-        cv2.imwrite(paths['stack_clean'], stack_clean)
+        writer.write(paths['stack_clean'], stack_clean)
         print("Clean slice stack saved to {}".format(paths['stack_clean']))
 
-    model = models.models[args["model"]]()
-    model.fit(intensity_profile, args["model_parameter"])
     print("Model coefficients: {}".format(model.coefs_str()))
 
+    if args['database'] is not None:
+        timestamp = database.timestamp_from_filename(args['image'])
+        if timestamp is None:
+            timestamp = os.path.getmtime(args['image'])
+        with database.ProfileDatabase(args['database'],
+                                      model=args['model']) as db:
+            db.append(timestamp, disk_attr, intensity_profile, model.coefs,
+                      name=os.path.basename(args['image']))
+        print("Profile and coefficients added to {}".format(
+            args['database']))
+
     corrected = None
     if args['operation'] in ('all', 'correct'):
         # Apply flat-field correction.
+        out = None
+        if args['format'] in output.FLOAT_FORMATS:
+            out = np.empty(gray.shape, dtype=np.float32)
         corrected = correction.correct_disk(gray, disk_attr, args['bias'],
-                                            model)
-        cv2.imwrite(paths['corrected'], corrected)
+                                            model, lut=args['lut'],
+                                            threads=args['threads'], out=out)
+        writer.write(paths['corrected'], corrected)
         print("Corrected image saved to {}".format(paths['corrected']))
 
     if args['operation'] in ('all', 'model'):
         # Plot intensity profile together with computed model.
         img_name = os.path.basename(args['image'])
-        plotter = plotting.Plotter(img_name, paths['plot'])
+        plotter = plotting.Plotter(img_name, paths['plot'],
+                                   headless=not args['interactive_plot'])
         plotter.plot_profile(intensity_profile, zorder=2)
         plotter.plot_model("Fitted", model, zorder=3)
 
@@ -116,6 +185,8 @@ def main():
             plotter.save()
             print("Intensity profile plot saved to {}".format(paths['plot']))
 
+    writer.close()
+
 
 if __name__ == "__main__":
     main()
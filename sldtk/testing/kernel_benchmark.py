@@ -0,0 +1,64 @@
+import os
+import timeit
+
+import cv2
+import numpy as np
+
+from sldtk import correction
+from sldtk import detection
+from sldtk import kernels
+from sldtk import models
+from sldtk import profile
+
+if __name__ == "__main__":
+    if not kernels.HAVE_NUMBA:
+        raise RuntimeError("numba is required to compare the kernels.")
+
+    path = os.path.join(os.path.dirname(__file__), "images",
+                        "20170315_125238_4096_HMII.jpg")
+
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise TypeError("img is none...")
+
+    disk_attr = detection.detect_disk(img, 10)
+
+    # Parity of the stack extraction (exact).
+    stack_np, valid_np = profile.extract_stack(img, disk_attr, 1000,
+                                               return_mask=True, jit=False)
+    stack_jit, valid_jit = profile.extract_stack(img, disk_attr, 1000,
+                                                 return_mask=True, jit=True)
+    assert np.array_equal(stack_np, stack_jit)
+    assert np.array_equal(valid_np, valid_jit)
+
+    model = models.Polynomial()
+    model.fit(profile.compress_stack(stack_np))
+    lut = model.lut()
+
+    # The default correction is unaffected by Numba being installed.
+    corrected = correction.correct_disk(img, disk_attr, 175, model)
+    direct = correction.correct_disk(img, disk_attr, 175, model, jit=False)
+    assert np.array_equal(corrected, direct)
+
+    # Parity of the correction (up to rounding of interpolated values), both
+    # with the NumPy lookup table path and with direct evaluation.
+    corrected_np = correction.correct_disk(img, disk_attr, 175, model,
+                                           lut=lut, jit=False)
+    corrected_jit = correction.correct_disk(img, disk_attr, 175, model,
+                                            lut=lut, jit=True)
+    for name, reference in (("lut", corrected_np), ("direct", direct)):
+        diff = cv2.absdiff(reference, corrected_jit)
+        assert diff.max() <= 1
+        print("Parity with {} OK, pixels differing by one level: {}".format(
+            name, cv2.countNonZero(diff)))
+
+    for jit in (False, True):
+        t_extract = timeit.timeit(
+            lambda: profile.extract_stack(img, disk_attr, 1000, jit=jit),
+            number=10) / 10
+        t_correct = timeit.timeit(
+            lambda: correction.correct_disk(img, disk_attr, 175, model,
+                                            lut=lut, jit=jit),
+            number=10) / 10
+        print("{}: extract {:.4f} s, correct {:.4f} s".format(
+            "numba" if jit else "numpy", t_extract, t_correct))
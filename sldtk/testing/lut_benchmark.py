@@ -0,0 +1,42 @@
+import os
+import timeit
+
+import cv2
+
+from sldtk import correction
+from sldtk import detection
+from sldtk import models
+from sldtk import profile
+
+if __name__ == "__main__":
+    path = os.path.join(os.path.dirname(__file__), "images",
+                        "20170315_125238_4096_HMII.jpg")
+
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise TypeError("img is none...")
+
+    disk_attr = detection.detect_disk(img, 10)
+    stack = profile.clean_stack(profile.extract_stack(img, disk_attr, 1000))
+    model = models.Polynomial()
+    model.fit(profile.compress_stack(stack))
+
+    # The NumPy lookup table path, not the JIT kernel (see kernel_benchmark).
+    for size in (None, 1024, 4096, 16384):
+        t = timeit.timeit(lambda: correction.correct_disk(img.copy(),
+                                                          disk_attr, 175,
+                                                          model, lut=size,
+                                                          jit=False),
+                          number=5) / 5
+        if size is None:
+            print("direct: {:.3f} s".format(t))
+        else:
+            print("lut {:>5}: {:.3f} s, max error {:.2e}".format(
+                size, t, model.lut_error(size)))
+
+    direct = correction.correct_disk(img.copy(), disk_attr, 175, model)
+    lut = correction.correct_disk(img.copy(), disk_attr, 175, model,
+                                  lut=4096, jit=False)
+    diff = cv2.absdiff(direct, lut)
+    print("Max pixel difference: {}, pixels differing: {}".format(
+        diff.max(), cv2.countNonZero(diff)))
@@ -0,0 +1,44 @@
+import os
+
+import cv2
+import numpy as np
+
+from sldtk import detection
+from sldtk import models
+from sldtk import profile
+
+# Largest acceptable difference between the coefficients fitted to the
+# cropped and to the full disk.
+TOLERANCE = 0.05
+
+
+def fit(img, per_pixel, estimator):
+    disk_attr = detection.detect_disk(img, 10, method="fit")
+    stack, valid = profile.extract_stack(img, disk_attr, 1000,
+                                         return_mask=True)
+    mask = profile.reject_outliers(stack, per_pixel=per_pixel, valid=valid)
+    model = models.Polynomial()
+    model.fit(profile.compress_stack(stack, mask=mask, estimator=estimator,
+                                     valid=valid))
+    return np.asarray(model.coefs, dtype=float)
+
+
+if __name__ == "__main__":
+    path = os.path.join(os.path.dirname(__file__), "images",
+                        "20170315_125238_4096_HMII_small.jpg")
+
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise TypeError("img is none...")
+
+    # The disk is cut off by the top and left edges of the crop.
+    cropped = img[200:, 300:]
+
+    for per_pixel in (False, True):
+        for estimator in profile.ESTIMATORS:
+            full = fit(img, per_pixel, estimator)
+            partial = fit(cropped, per_pixel, estimator)
+            print("per_pixel={}, {}: full {}, cropped {}".format(
+                per_pixel, estimator, np.round(full, 2),
+                np.round(partial, 2)))
+            assert np.abs(full - partial).max() <= TOLERANCE
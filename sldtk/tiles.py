@@ -0,0 +1,166 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from .correction import correct_region
+from .models.limb_model import DEFAULT_LUT_SIZE
+
+DZI_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+                'Format="{fmt}" Overlap="0" TileSize="{tile_size}">\n'
+                '  <Size Width="{width}" Height="{height}"/>\n'
+                '</Image>\n')
+
+
+class TilePyramid(object):
+    """Render deep zoom tiles of a flat field corrected solar image on demand.
+
+    Tiles are corrected individually from the disk attributes and model,
+    so only the tiles that are actually requested are ever computed.
+
+    Parameters
+    ----------
+    img : numpy.ndarray
+        Greyscale image containing a solar disk. It is not modified.
+    disk_attr : tuple of 3 numbers
+        The x, y and r properties of the solar disk present in the image.
+    bias : int or float
+        Brightness level of the disk's centre.
+    model : limb_model.LimbModel
+        Fitted model used for radius-based flat field generation.
+    tile_size : int, optional
+        Width and height of the (square) tiles.
+    lut : int or numpy.ndarray, optional
+        Lookup table size or table used to evaluate `model`, see
+        `correction.correct_disk`.
+
+    Notes
+    -----
+    Levels follow the Deep Zoom convention: level `max_level` is the image
+    at full resolution, and each level below it halves its dimensions
+    down to a single pixel at level 0.
+
+    """
+    def __init__(self, img, disk_attr, bias, model, tile_size=256,
+                 lut=DEFAULT_LUT_SIZE):
+        self.disk_attr = disk_attr
+        self.bias = bias
+        self.model = model
+        self.tile_size = tile_size
+        self.lut = model.lut(lut) if lut is not None else None
+        self.height, self.width = img.shape[:2]
+        self.max_level = int(math.ceil(math.log2(max(self.height,
+                                                     self.width))))
+        self._levels = {self.max_level: img}
+        self._lock = threading.Lock()
+
+    def level_shape(self, level):
+        """Height and width of the image at `level`."""
+        scale = 2 ** (self.max_level - level)
+        return (int(math.ceil(self.height / scale)),
+                int(math.ceil(self.width / scale)))
+
+    def num_tiles(self, level):
+        """Number of tile rows and columns at `level`."""
+        height, width = self.level_shape(level)
+        return (int(math.ceil(height / self.tile_size)),
+                int(math.ceil(width / self.tile_size)))
+
+    def tile(self, level, col, row):
+        """Render a single corrected tile.
+
+        Parameters
+        ----------
+        level : int
+            Zoom level, from 0 to `max_level`.
+        col, row : int
+            Position of the tile within the level.
+
+        Returns
+        -------
+        numpy.ndarray
+            The corrected tile (smaller than `tile_size` along the right and
+            bottom edges of the image).
+
+        """
+        img = self._level(level)
+        scale = 2 ** (self.max_level - level)
+        x, y, r = self.disk_attr
+        # Pixel centers of the downsampled level.
+        disk_attr = ((x + 0.5) / scale - 0.5, (y + 0.5) / scale - 0.5,
+                     r / scale)
+        window = (col * self.tile_size, row * self.tile_size,
+                  self.tile_size, self.tile_size)
+        return correct_region(img, window, disk_attr, self.bias, self.model,
+                              lut=self.lut)
+
+    def tiles(self, level):
+        """Generate (col, row, tile) for all tiles of `level`, lazily."""
+        rows, cols = self.num_tiles(level)
+        for row in range(rows):
+            for col in range(cols):
+                yield col, row, self.tile(level, col, row)
+
+    def save(self, out_dir, name, fmt="png", levels=None, threads=None):
+        """Write the pyramid in the Deep Zoom (DZI) layout.
+
+        Parameters
+        ----------
+        out_dir : str
+            Directory in which `name`.dzi and `name`_files/ are created.
+        name : str
+            Base name of the pyramid.
+        fmt : str, optional
+            Image format (extension) of the tiles.
+        levels : iterable of int, optional
+            Levels to render, all by default.
+        threads : int, optional
+            Number of worker threads rendering and encoding tiles. None uses
+            the default of `concurrent.futures.ThreadPoolExecutor`.
+
+        Returns
+        -------
+        str
+            Path of the written .dzi descriptor.
+
+        """
+        if levels is None:
+            levels = range(self.max_level + 1)
+        tiles_dir = os.path.join(out_dir, "{}_files".format(name))
+        jobs = list()
+        for level in levels:
+            os.makedirs(os.path.join(tiles_dir, str(level)), exist_ok=True)
+            rows, cols = self.num_tiles(level)
+            jobs.extend((level, col, row)
+                        for row in range(rows) for col in range(cols))
+
+        def write(job):
+            level, col, row = job
+            path = os.path.join(tiles_dir, str(level),
+                                "{}_{}.{}".format(col, row, fmt))
+            cv2.imwrite(path, self.tile(level, col, row))
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(write, jobs))
+
+        dzi_path = os.path.join(out_dir, "{}.dzi".format(name))
+        with open(dzi_path, "w") as f:
+            f.write(DZI_TEMPLATE.format(fmt=fmt, tile_size=self.tile_size,
+                                        width=self.width, height=self.height))
+        return dzi_path
+
+    def _level(self, level):
+        """The (cached) image downsampled to `level`."""
+        with self._lock:
+            return self._downsample(level)
+
+    def _downsample(self, level):
+        if level not in self._levels:
+            finer = self._downsample(level + 1)
+            height, width = self.level_shape(level)
+            self._levels[level] = cv2.resize(finer, (width, height),
+                                             interpolation=cv2.INTER_AREA)
+        return self._levels[level]